@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import platform
+import time
+import warnings
+import cv2
+import numpy as np
+import torch
+import inference1
+from inference1 import get_memory_usage
+import reference_features
+from features import landmark_features
+from pose_regressor import pose_features
+from classifier import LSTMClassifier
+from model_registry import load_classifier, load_face_mesh, load_head_pose, LSTM_MODELS
+from roi import ROITracker, landmark_array
+from decision import DrowsinessState
+from calibration import calibration_stats
+from window import FeatureWindow
+from recorder import read_records, window_features
+
+def synthetic_landmarks(n_frames, seed=0, blink_period=90):
+    ''' Synthetic FaceMesh stream: a fixed random face with per-frame jitter, slow head motion and blinks
+    :return: Normalized landmarks of shape (n_frames, 468, 2)
+    '''
+    rng = np.random.default_rng(seed)
+    face = rng.uniform(0.35, 0.65, size=(468, 2))
+    t = np.arange(n_frames)
+    landmarks = face[None] + rng.normal(scale=0.001, size=(n_frames, 468, 2))
+    landmarks += 0.02 * np.stack([np.sin(t / 200), np.cos(t / 300)], axis=1)[:, None, :]
+    # close the eyes for a few frames every blink_period frames by pulling the upper lids down
+    closed = np.flatnonzero((t % blink_period) < 4)
+    lids = [160, 159, 158, 387, 386, 385]
+    landmarks[closed[:, None], lids, 1] += 0.01
+    return landmarks
+
+def measure(fn, inputs, warmup=20):
+    ''' Time fn over every input
+    :return: Latency percentiles (ms), throughput and RSS growth
+    '''
+    for item in inputs[:warmup]:
+        fn(item)
+    rss_before = get_memory_usage()
+    latencies = np.empty(len(inputs))
+    for i, item in enumerate(inputs):
+        start = time.perf_counter()
+        fn(item)
+        latencies[i] = time.perf_counter() - start
+    latencies *= 1000
+    return {
+        'calls': len(inputs),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'fps': float(1000 / latencies.mean()),
+        'rss_mb': get_memory_usage(),
+        'rss_growth_mb': get_memory_usage() - rss_before,
+    }
+
+def calibration_norms(features, poses):
+    return calibration_stats(*features.T, *poses.T)
+
+def bench_synthetic(n_frames, width=1280, height=720):
+    landmarks = synthetic_landmarks(n_frames)
+    pixels = landmarks * [width, height]
+    face_features = pose_features(landmarks)
+    frames = list(range(n_frames))
+    results = {}
+
+    results['distance'] = measure(lambda i: reference_features.distance(pixels[i][33], pixels[i][133]), frames)
+    results['eye_feature'] = measure(lambda i: reference_features.eye_feature(pixels[i]), frames)
+    results['pupil_feature'] = measure(lambda i: reference_features.pupil_feature(pixels[i]), frames)
+    results['landmark_features'] = measure(lambda i: landmark_features(pixels[i]), frames)
+    results['landmark_features_batch_per_frame'] = per_frame(measure(lambda _: landmark_features(pixels), [0] * 20), n_frames)
+
+    results['normalize_test'] = measure(lambda i: inference1.normalize_test(face_features[i]), frames)
+    results['head_pose'] = measure(lambda i: inference1.head_pose(face_features[i]), frames)
+
+    features = landmark_features(pixels)
+    poses = inference1.model_head_pose.predict_pose(face_features)
+    windows = [features[i:i + 20].tolist() for i in range(0, n_frames - 20, 15)]
+    results['get_classification'] = measure(lambda w: inference1.get_classification(w), windows)
+
+    # post-FaceMesh decision step: features -> EMA -> window -> LSTM -> alert
+    state = DrowsinessState(*calibration_norms(features, poses), inference1.get_classification)
+    results['decision_step'] = measure(lambda i: state.step(*features[i], *poses[i], True), frames)
+    return results
+
+def feature_parity(n_frames, width=1280, height=720):
+    ''' Largest difference between the vectorized landmark_features and the scalar reference implementation
+    :return: Dict with the max absolute error of ear, mar and puc
+    '''
+    pixels = synthetic_landmarks(n_frames) * [width, height]
+    fast = np.asarray(landmark_features(pixels))
+    reference = np.array([[reference_features.eye_feature(p), reference_features.mouth_feature(p),
+                           reference_features.pupil_feature(p)] for p in pixels])
+    return {name: float(np.abs(fast[:, i] - reference[:, i]).max()) for i, name in enumerate(('ear', 'mar', 'puc'))}
+
+def synthetic_window_features(n_frames, seed=0, scale=2.0):
+    ''' Smoothed, normalized (ear, mar, puc, moe) stream as DrowsinessState pushes it into the FeatureWindow:
+    AR(1) noise around a slow drift towards closed eyes / open mouth and back, so both labels occur
+    :return: Array of shape (n_frames, 4)
+    '''
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(scale=0.4 * scale, size=(n_frames, 4))
+    features = np.zeros((n_frames, 4), dtype=np.float32)
+    for i in range(1, n_frames):
+        features[i] = 0.9 * features[i - 1] + 0.1 * noise[i]
+    features += scale * np.sin(np.arange(n_frames) / 150)[:, None] * np.array([-1, 1, -1, 1], dtype=np.float32)
+    return features
+
+def streaming_parity(sequence, baseline, stream, run_every=15):
+    ''' Feed the same window features to the six-window vote (LSTMClassifier) and to the StreamingClassifier
+    and compare their decision at every classification
+    :param sequence: (N, 4) features pushed into the FeatureWindow, e.g. recorded ear_main, mar_main, puc_main, moe_main
+    :return: Decision counts, mismatches, largest score difference and the classifier cost per frame (ms)
+    '''
+    window = FeatureWindow(run_every=run_every)
+    stream.reset()
+    misses = stream.cache_misses
+    baseline_seconds, stream_seconds, push_seconds = 0.0, 0.0, []
+    decisions, drowsy, mismatches, max_diff = 0, 0, 0, 0.0
+    for features in sequence:
+        due = window.push(features)
+        start = time.perf_counter()
+        stream.push(features)
+        push_seconds.append(time.perf_counter() - start)
+        if not due:
+            continue
+        start = time.perf_counter()
+        label = baseline.classify(window)
+        baseline_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        stream_label = stream.classify(window)
+        stream_seconds += time.perf_counter() - start
+        decisions += 1
+        drowsy += label
+        mismatches += label != stream_label
+        max_diff = max(max_diff, float(np.abs(baseline.last_scores - stream.last_scores).max()))
+    push_ms = np.array(push_seconds) * 1000
+    return {
+        'frames': len(sequence),
+        'decisions': decisions,
+        'drowsy': drowsy,
+        'mismatches': mismatches,
+        'max_score_diff': max_diff,
+        'cache_misses': stream.cache_misses - misses,
+        'vote_ms_per_frame': 1000 * baseline_seconds / max(len(sequence), 1),
+        'streaming_ms_per_frame': float(push_ms.mean()) + 1000 * stream_seconds / max(len(sequence), 1),
+        'push_p99_ms': float(np.percentile(push_ms, 99)),
+    }
+
+def per_frame(result, n_frames):
+    ''' Convert the stats of a batched call into per-frame stats '''
+    scaled = dict(result)
+    for key in ['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms']:
+        scaled[key] = result[key] / n_frames
+    scaled['fps'] = result['fps'] * n_frames
+    return scaled
+
+def read_clip(path, max_frames):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        success, image = cap.read()
+        if not success:
+            break
+        frames.append(image)
+    cap.release()
+    return frames
+
+def bench_clip(path, max_frames):
+    ''' Full run_face_mp -> decision step over the frames of a recorded clip (no camera, no serial port) '''
+    frames = read_clip(path, max_frames)
+    if not frames:
+        raise ValueError('could not read %s' % path)
+    height, width = frames[0].shape[:2]
+
+    def run(image):
+        return inference1.run_face_mp(image.copy(), height=height, width=width, serial_io=False)
+
+    outputs = [run(image) for image in frames]
+    found = [o for o in outputs if o[0] != -1000]
+    if not found:
+        raise ValueError('no face found in %s' % path)
+    norms = calibration_norms(np.array([o[:4] for o in found]), np.array([o[4:7] for o in found]))
+    state = DrowsinessState(*norms, inference1.get_classification)
+
+    def step(image):
+        ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, _ = run(image)
+        state.step(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, inference1.detect)
+
+    return {'run_face_mp': measure(run, frames, warmup=5), 'run_face_mp_decision': measure(step, frames, warmup=5)}
+
+def bench_roi(path, max_frames, max_side=256):
+    ''' FaceMesh on the full frame against FaceMesh on ROITracker crops, over the frames of a recorded clip
+    :return: Timings of both runs, and the accuracy of the ROI run relative to the full-frame run
+        (detection agreement, landmark error in pixels, absolute EAR/MAR/PUC/MOE error)
+    '''
+    frames = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in read_clip(path, max_frames)]
+    if not frames:
+        raise ValueError('could not read %s' % path)
+    height, width = frames[0].shape[:2]
+    full_mesh, roi_mesh = load_face_mesh(), load_face_mesh()
+    tracker = ROITracker(load_face_mesh(), max_side=max_side)
+    full, roi = [], []
+
+    def run_full(image):
+        results = full_mesh.process(image)
+        full.append(landmark_array(results.multi_face_landmarks[0]) if results.multi_face_landmarks else None)
+
+    def run_roi(image):
+        roi.append(tracker.process(roi_mesh, image)[1])
+
+    # no warmup: FaceMesh tracks between frames, every frame must be processed once and in order
+    timings = {'facemesh_full': measure(run_full, frames, warmup=0),
+               'facemesh_roi[%d]' % max_side: measure(run_roi, frames, warmup=0)}
+
+    both = [i for i in range(len(frames)) if full[i] is not None and roi[i] is not None]
+    accuracy = {
+        'frames': len(frames),
+        'detected_full': sum(f is not None for f in full),
+        'detected_roi': sum(r is not None for r in roi),
+        'crop_frames': tracker.crop_frames,
+        'fallbacks': tracker.fallbacks,
+    }
+    if both:
+        full_px = np.array([full[i] for i in both]) * [width, height]
+        roi_px = np.array([roi[i] for i in both]) * [width, height]
+        error = np.linalg.norm(full_px - roi_px, axis=2)
+        feature_error = np.abs(landmark_features(full_px) - landmark_features(roi_px)).mean(axis=0)
+        accuracy.update({
+            'landmark_error_px_mean': float(error.mean()),
+            'landmark_error_px_p95': float(np.percentile(error, 95)),
+            'feature_error_mean': dict(zip(['ear', 'mar', 'puc', 'moe'], feature_error.tolist())),
+        })
+    return timings, accuracy
+
+def setup_models(head_pose_path, lstm_path, threads, with_face_mesh):
+    ''' Populate the module globals inference1 expects from its __main__ block '''
+    inference1.model_head_pose = load_head_pose(head_pose_path)
+    inference1.classifier = load_classifier(lstm_path, num_threads=threads)
+    inference1.states = ['normal', 'drowsy']
+    if with_face_mesh:
+        import mediapipe as mp
+        inference1.mp_face_mesh = mp.solutions.face_mesh
+        inference1.face_mesh = mp.solutions.face_mesh.FaceMesh(min_detection_confidence=0.3, min_tracking_confidence=0.8)
+        inference1.mp_drawing = mp.solutions.drawing_utils
+        inference1.drawing_spec = inference1.mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+
+def compare(results, baseline):
+    ''' Print the p50/p95 change of every benchmark present in both runs '''
+    print('%-40s %12s %12s %8s' % ('benchmark', 'p50 base', 'p50 now', 'ratio'))
+    for name, now in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        print('%-40s %10.4fms %10.4fms %7.2fx' % (name, base['p50_ms'], now['p50_ms'], base['p50_ms'] / max(now['p50_ms'], 1e-12)))
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category=UserWarning)
+    parser = argparse.ArgumentParser(description='Latency benchmarks on synthetic landmark streams and recorded clips')
+    parser.add_argument('--frames', type=int, default=2000, help='length of the synthetic landmark stream')
+    parser.add_argument('--clips', nargs='*', default=[], help='recorded clips for the full run_face_mp benchmark')
+    parser.add_argument('--clip-frames', type=int, default=300, help='frames read from every clip')
+    parser.add_argument('--roi-sizes', type=int, nargs='*', default=[256],
+                        help='ROI crop sizes compared against full-frame FaceMesh on every clip')
+    parser.add_argument('--head-pose', default='head_pose.npz')
+    parser.add_argument('--lstm', default='clf_lstm', help='one of %s or a model path' % ', '.join(LSTM_MODELS))
+    parser.add_argument('--torch-threads', type=int, default=1)
+    parser.add_argument('--parity-recordings', nargs='*', default=[],
+                        help='recorder.py files whose smoothed features are replayed through the streaming parity check')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    setup_models(args.head_pose, args.lstm, args.torch_threads, with_face_mesh=bool(args.clips))
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'torch': torch.__version__,
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'frames': args.frames,
+        },
+        'results': bench_synthetic(args.frames),
+        'feature_parity': feature_parity(args.frames),
+        'roi_accuracy': {},
+        'streaming_parity': {},
+    }
+    if isinstance(inference1.classifier, LSTMClassifier):
+        stream = load_classifier(args.lstm, num_threads=args.torch_threads, streaming=True)
+        sequences = {'synthetic': synthetic_window_features(args.frames)}
+        for path in args.parity_recordings:
+            sequences[os.path.basename(path)] = window_features(read_records(path))
+        for name, sequence in sequences.items():
+            for every in (1, stream.stride):
+                stream.every = every
+                results['streaming_parity']['%s[every=%d]' % (name, every)] = streaming_parity(sequence, inference1.classifier, stream)
+    for path in args.clips:
+        for name, result in bench_clip(path, args.clip_frames).items():
+            results['results']['%s[%s]' % (name, os.path.basename(path))] = result
+        for size in args.roi_sizes:
+            timings, accuracy = bench_roi(path, args.clip_frames, size)
+            for name, result in timings.items():
+                results['results']['%s[%s]' % (name, os.path.basename(path))] = result
+            results['roi_accuracy']['%d[%s]' % (size, os.path.basename(path))] = accuracy
+
+    for name, result in results['results'].items():
+        print('%-40s p50 %8.4fms  p95 %8.4fms  p99 %8.4fms  %10.1f fps' %
+              (name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['fps']))
+    print('landmark_features vs reference: max error %s' % results['feature_parity'])
+    for name, accuracy in results['roi_accuracy'].items():
+        print('roi %s: %s' % (name, accuracy))
+    for name, parity in results['streaming_parity'].items():
+        print('streaming %s: %d/%d decisions differ (max score diff %.2g, %d cache misses), %.4f ms/frame vs %.4f ms/frame for the vote'
+              % (name, parity['mismatches'], parity['decisions'], parity['max_score_diff'], parity['cache_misses'],
+                 parity['streaming_ms_per_frame'], parity['vote_ms_per_frame']))
+    print('RSS %.1f MB' % get_memory_usage())
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+FEATURES = ['ear', 'mar', 'puc', 'moe', 'pitch', 'yaw', 'roll']
+
+def calibration_stats(ears, mars, pucs, moes, pitch_preds, yaw_preds, roll_preds):
+    ''' Compute the normalization values from the features collected in neutral state
+    :return: [mean, std] for EAR, MAR, PUC and MOE, followed by the pitch, yaw and roll baselines
+    '''
+    ears = np.array(ears)
+    mars = np.array(mars)
+    pucs = np.array(pucs)
+    moes = np.array(moes)
+
+    pitch_mean_zscore = np.array(pitch_preds).mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
+    yaw_mean_zscore = np.array(yaw_preds).mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
+    roll_mean_zscore = np.array(roll_preds).mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
+
+    return [ears.mean(), ears.std()], [mars.mean(), mars.std()], \
+        [pucs.mean(), pucs.std()], [moes.mean(), moes.std()], \
+        pitch_mean_zscore, yaw_mean_zscore, roll_mean_zscore
+
+
+class RunningStats:
+    ''' Welford running mean / variance of the neutral-state features (ear, mar, puc, moe, pitch, yaw, roll).
+    The sample count is capped at max_count so old samples are slowly forgotten and the baselines follow the driver.
+    '''
+    def __init__(self, max_count=3000):
+        '''
+        :param max_count: Sample count above which new samples get a constant weight of 1 / max_count
+        '''
+        self.max_count = max_count
+        self.count = 0
+        self.mean = np.zeros(len(FEATURES))
+        self.m2 = np.zeros(len(FEATURES))
+
+    @classmethod
+    def from_norms(cls, norms, count, max_count=3000):
+        ''' Build the stats from calibration_stats() output (the pose spread is unknown and set to 0)
+        :param count: Number of frames the norms were computed from
+        '''
+        stats = cls(max_count)
+        ears_norm, mars_norm, pucs_norm, moes_norm, pitch, yaw, roll = norms
+        stats.count = count
+        stats.mean[:] = [ears_norm[0], mars_norm[0], pucs_norm[0], moes_norm[0], pitch, yaw, roll]
+        stats.m2[:4] = np.square([ears_norm[1], mars_norm[1], pucs_norm[1], moes_norm[1]]) * count
+        return stats
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data.get('max_count', 3000))
+        stats.count = data['count']
+        stats.mean[:] = data['mean']
+        stats.m2[:] = data['m2']
+        return stats
+
+    def to_dict(self):
+        return {'count': self.count, 'max_count': self.max_count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    def update(self, ear, mar, puc, moe, pitch, yaw, roll):
+        ''' Add the raw features of one neutral frame '''
+        x = np.array([ear, mar, puc, moe, pitch, yaw, roll])
+        if self.count >= self.max_count:
+            self.m2 *= (self.max_count - 1) / self.max_count
+        else:
+            self.count += 1
+        delta = x - self.mean
+        self.mean += delta / max(self.count, 1)
+        self.m2 += delta * (x - self.mean)
+
+    def merged(self, other):
+        ''' Combined stats of two sample sets (Chan et al. parallel update)
+        :return: New RunningStats, self and other are unchanged
+        '''
+        stats = RunningStats(self.max_count)
+        count = self.count + other.count
+        if count == 0:
+            return stats
+        delta = other.mean - self.mean
+        stats.mean = self.mean + delta * other.count / count
+        stats.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        if count > self.max_count:
+            stats.m2 *= self.max_count / count
+            count = self.max_count
+        stats.count = count
+        return stats
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+    def valid(self):
+        ''' Usable for the z-score normalization: finite means and a positive, finite EAR/MAR/PUC/MOE spread '''
+        std = self.std[:4]
+        return bool(np.isfinite(self.mean).all() and np.isfinite(std).all() and (std > 0).all())
+
+    def norms(self):
+        ''' Normalization values in the calibration_stats() format '''
+        std = self.std
+        return [self.mean[0], std[0]], [self.mean[1], std[1]], \
+            [self.mean[2], std[2]], [self.mean[3], std[3]], \
+            self.mean[4], self.mean[5], self.mean[6]
+
+    def drift(self, reference):
+        ''' Largest shift of the EAR/MAR/PUC/MOE means relative to a reference profile, in reference standard deviations.
+        The head pose is left out: only frames with the head up (pitch within the decision thresholds) count as
+        neutral, so the pitch mean can never shift further than those thresholds
+        :param reference: RunningStats of the stored profile
+        '''
+        scale = np.maximum(reference.std[:4], 1e-6)
+        return float(np.max(np.abs(self.mean[:4] - reference.mean[:4]) / scale))
+
+
+class CalibrationStore:
+    ''' Calibration profiles keyed by driver, persisted as one JSON file.
+    Profiles older than max_age seconds are evicted when loaded, and only the max_profiles most
+    recently used profiles are kept. Safe to share between sessions running on different threads.
+    '''
+    def __init__(self, path='calibration.json', max_age=30 * 24 * 3600, max_profiles=20):
+        '''
+        :param path: JSON file holding the profiles
+        :param max_age: Seconds after which a profile is stale and the driver is calibrated again
+        :param max_profiles: Number of drivers kept, least recently used profiles are evicted
+        '''
+        self.path = path
+        self.max_age = max_age
+        self.max_profiles = max_profiles
+        self.profiles = {}
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.profiles = json.load(f)
+            except ValueError:
+                print('Ignoring corrupt calibration store %s' % path)
+
+    def load(self, driver):
+        ''' Stored profile of a driver
+        :return: RunningStats, or None if the driver has no profile or it is stale
+        '''
+        with self._lock:
+            entry = self.profiles.get(driver)
+            if entry is None:
+                return None
+            if time.time() - entry['updated'] > self.max_age:
+                del self.profiles[driver]
+                self._write()
+                return None
+            entry['used'] = time.time()
+            return RunningStats.from_dict(entry['stats'])
+
+    def save(self, driver, stats):
+        now = time.time()
+        with self._lock:
+            self.profiles[driver] = {'updated': now, 'used': now, 'stats': stats.to_dict()}
+            for name in sorted(self.profiles, key=lambda name: self.profiles[name]['used'])[:-self.max_profiles]:
+                del self.profiles[name]
+            self._write()
+
+    def evict(self, driver):
+        with self._lock:
+            if self.profiles.pop(driver, None) is not None:
+                self._write()
+
+    def _write(self):
+        # write then rename so a power cut never leaves a truncated store
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.profiles, f)
+        os.replace(tmp, self.path)
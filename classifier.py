@@ -0,0 +1,397 @@
+import threading
+import time
+import numpy as np
+import torch
+from torch import nn
+from window import FeatureWindow, sub_windows, n_sub_windows, WINDOW_LENGTH, SUB_WINDOW_SIZE, SUB_WINDOW_STRIDE
+
+class CLFLSTM(nn.Module):
+    ''' Eager re-implementation of the CLF_LSTM TorchScript graph.
+    The exported graph hard-codes an LSTM state of batch 6, this module accepts any number of sub-windows
+    so many windows (or many drivers) can be scored in one forward pass.
+    '''
+    def __init__(self, n_features, seq_len, hidden_size, num_layers, fc_sizes):
+        super().__init__()
+        self.n_features = n_features
+        self.seq_len = seq_len
+        self.hidden_size = hidden_size
+        self.pre_fc = nn.Linear(n_features * seq_len, seq_len * hidden_size)
+        self.lstm = nn.LSTM(hidden_size, hidden_size, num_layers, batch_first=True)
+        sizes = [hidden_size] + list(fc_sizes)
+        self.fcs = nn.ModuleList([nn.Linear(sizes[i], sizes[i + 1]) for i in range(len(fc_sizes))])
+
+    @classmethod
+    def from_torchscript(cls, model):
+        ''' Build the eager module from the parameters of the TorchScript model
+        :param model: Loaded clf_lstm TorchScript module
+        '''
+        state = {name: param.detach() for name, param in model.named_parameters()}
+        hidden_size = state['lstm.weight_hh_l0'].shape[1]
+        num_layers = len([name for name in state if name.startswith('lstm.weight_ih_l')])
+        seq_len = state['pre_fc.weight'].shape[0] // hidden_size
+        n_features = state['pre_fc.weight'].shape[1] // seq_len
+        fc_names = sorted({name.split('.')[0] for name in state if name.startswith('fc')}, key=lambda n: int(n[2:]))
+        module = cls(n_features, seq_len, hidden_size, num_layers, [state[n + '.weight'].shape[0] for n in fc_names])
+        module.pre_fc.load_state_dict({'weight': state['pre_fc.weight'], 'bias': state['pre_fc.bias']})
+        module.lstm.load_state_dict({name[5:]: value for name, value in state.items() if name.startswith('lstm.')})
+        for fc, name in zip(module.fcs, fc_names):
+            fc.load_state_dict({'weight': state[name + '.weight'], 'bias': state[name + '.bias']})
+        module.requires_grad_(False)
+        return module.eval()
+
+    def forward(self, x):
+        out = torch.relu(self.pre_fc(x.reshape(-1, self.seq_len * self.n_features)))
+        out, _ = self.lstm(out.reshape(-1, self.seq_len, self.hidden_size))
+        out = out[:, -1]
+        for fc in self.fcs[:-1]:
+            out = torch.relu(fc(out))
+        return self.fcs[-1](out)
+
+
+class HybridCNNLSTM(nn.Module):
+    ''' Eager re-implementation of the HybridCNNLSTM TorchScript graphs (best_model_jit, latest_model_jit).
+    The exported graphs move their input to "cuda" unconditionally, this module runs on any device.
+    Conv1d (+ batch norm in best_model_jit) x2 -> max pool -> bidirectional LSTM -> attention pooling
+    -> fc1/bn1 -> fc2 -> fc3 -> sigmoid
+    '''
+    def __init__(self, n_features, conv_sizes, hidden_size, num_layers, fc_size, fc2_size, conv_bn=False):
+        super().__init__()
+        self.conv1 = nn.Conv1d(n_features, conv_sizes[0], 3, padding=1)
+        self.conv2 = nn.Conv1d(conv_sizes[0], conv_sizes[1], 3, padding=1)
+        self.bn_conv1 = nn.BatchNorm1d(conv_sizes[0]) if conv_bn else nn.Identity()
+        self.bn_conv2 = nn.BatchNorm1d(conv_sizes[1]) if conv_bn else nn.Identity()
+        self.pool = nn.MaxPool1d(2)
+        self.lstm = nn.LSTM(conv_sizes[1], hidden_size, num_layers, batch_first=True, bidirectional=True)
+        self.attention = nn.Linear(2 * hidden_size, 2 * hidden_size)
+        self.context_vector = nn.Parameter(torch.zeros(2 * hidden_size, 1))
+        self.fc1 = nn.Linear(2 * hidden_size, fc_size)
+        self.bn1 = nn.BatchNorm1d(fc_size)
+        self.fc2 = nn.Linear(fc_size, fc2_size)
+        self.fc3 = nn.Linear(fc2_size, 1)
+
+    @classmethod
+    def from_torchscript(cls, model):
+        ''' Build the eager module from the parameters and buffers of the TorchScript model.
+        The graphs were exported in training mode, the eager module is always in eval mode (no dropout, batch norm running stats)
+        :param model: Loaded HybridCNNLSTM TorchScript module (map_location='cpu')
+        '''
+        state = {name: value.detach() for name, value in model.state_dict().items()}
+        module = cls(state['conv1.weight'].shape[1], [state['conv1.weight'].shape[0], state['conv2.weight'].shape[0]],
+                     state['lstm.weight_hh_l0'].shape[1], len([n for n in state if n.startswith('lstm.weight_ih_l') and 'reverse' not in n]),
+                     state['fc1.weight'].shape[0], state['fc2.weight'].shape[0], conv_bn='bn_conv1.weight' in state)
+        module.load_state_dict(state)
+        module.requires_grad_(False)
+        return module.eval()
+
+    def forward(self, x):
+        out = torch.relu(self.bn_conv1(self.conv1(x.permute(0, 2, 1))))
+        out = self.pool(torch.relu(self.bn_conv2(self.conv2(out)))).permute(0, 2, 1)
+        out, _ = self.lstm(out)
+        weights = torch.softmax((torch.tanh(self.attention(out)) @ self.context_vector).squeeze(-1), 1)
+        out = (weights.unsqueeze(-1) * out).sum(1)
+        out = torch.relu(self.bn1(self.fc1(out)))
+        out = nn.functional.leaky_relu(self.fc2(out), 0.01)
+        return torch.sigmoid(self.fc3(out))
+
+
+class LSTMClassifier:
+    ''' Drowsiness classifier around the clf_lstm TorchScript model.
+    The (6, 5, 4) input tensor is allocated once and refilled in place for every decision.
+    '''
+    def __init__(self, model, window_length=WINDOW_LENGTH, sub_window_size=SUB_WINDOW_SIZE, stride=SUB_WINDOW_STRIDE,
+                 n_features=4, threshold=0.5, min_votes=5, num_threads=None, batch_model=None):
+        '''
+        :param model: Loaded TorchScript model
+        :param threshold: Score above which a sub-window is voted drowsy
+        :param min_votes: Number of drowsy sub-windows needed for a drowsy decision
+        :param num_threads: Pin the torch intra-op thread count (None keeps the torch default)
+        :param batch_model: Module for scores_batch taking any number of sub-windows, default the CLFLSTM rebuild of model
+        '''
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.model = model.eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+        self.sub_window_size = sub_window_size
+        self.stride = stride
+        self.threshold = threshold
+        self.min_votes = min_votes
+        self._input = torch.zeros((n_sub_windows(window_length, sub_window_size, stride), sub_window_size, n_features),
+                                  dtype=torch.float32)
+        self._input_np = self._input.numpy()  # shares memory with self._input
+        self._batch_model = batch_model
+        self.last_scores = None # scores of the last classify() call, used as LSTM confidence
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(torch.jit.load(path, map_location='cpu'), **kwargs)
+
+    @property
+    def batch_model(self):
+        if self._batch_model is None:
+            self._batch_model = CLFLSTM.from_torchscript(self.model)
+        return self._batch_model
+
+    def scores(self, input_data):
+        ''' Score the sub-windows of one feature window
+        :param input_data: FeatureWindow, or feature window of shape (20, 4) as list or array
+        :return: Array of shape (6,) with the model output of every sub-window
+        '''
+        if isinstance(input_data, FeatureWindow):
+            np.copyto(self._input_np, input_data.sub_windows())
+        else:
+            np.copyto(self._input_np, sub_windows(input_data, self.sub_window_size, self.stride))
+        with torch.inference_mode():
+            return self.model(self._input).numpy().ravel()
+
+    def classify(self, input_data):
+        ''' Perform classification over the facial features of one window.
+        :return: 1 for drowsy, 0 for normal
+        '''
+        self.last_scores = self.scores(input_data)
+        return int((self.last_scores > self.threshold).sum() >= self.min_votes)
+
+    def scores_batch(self, windows):
+        ''' Score many windows in a single forward pass
+        :param windows: Array of shape (B, 20, 4)
+        :return: Array of shape (B, 6)
+        '''
+        windows = sub_windows(windows, self.sub_window_size, self.stride)
+        batch, n_sub = windows.shape[:2]
+        with torch.inference_mode():
+            out = self.batch_model(torch.from_numpy(np.ascontiguousarray(windows)))
+        return out.numpy().reshape(batch, n_sub)
+
+    def classify_batch(self, windows):
+        ''' Classify many windows (e.g. a whole recording or several drivers) at once
+        :param windows: Array of shape (B, 20, 4)
+        :return: Int array of shape (B,) with 1 for drowsy and 0 for normal
+        '''
+        return self.labels(self.scores_batch(windows))
+
+    def labels(self, scores):
+        ''' 5 of 6 vote over scores_batch() output
+        :return: Int array of shape (B,) with 1 for drowsy and 0 for normal
+        '''
+        return ((scores > self.threshold).sum(axis=1) >= self.min_votes).astype(int)
+
+
+class StreamingClassifier(LSTMClassifier):
+    ''' Incremental clf_lstm: push() scores only the sub-window ending at the newest frame and caches the score.
+    The sub-windows of a window are independent LSTM runs (the state starts at zero for each of them), so the six
+    scores of any window ending at the newest frame are the cached scores of that frame and of the frames
+    3, 6, ... 15 before it. classify() is the same 5 of 6 vote as LSTMClassifier without running the model,
+    and a drowsiness probability is available after every frame at the cost of one 5-frame sub-window.
+    With every=stride only the sub-windows a classification uses are scored (a third of the cost),
+    the probability is then updated every stride frames.
+    '''
+    streaming = True # DrowsinessState pushes every frame into it
+
+    def __init__(self, model, window_length=WINDOW_LENGTH, sub_window_size=SUB_WINDOW_SIZE, stride=SUB_WINDOW_STRIDE,
+                 n_features=4, threshold=0.5, min_votes=5, num_threads=None, every=1):
+        '''
+        :param model: Eager CLFLSTM (the TorchScript graph only accepts 6 sub-windows at once)
+        :param every: Score the sub-window ending at every n-th frame, aligned to the end of the first full window
+        '''
+        super().__init__(model, window_length, sub_window_size, stride, n_features, threshold, min_votes, num_threads)
+        self.n_sub_windows = self._input.shape[0]
+        self._batch_model = self.model
+        self._frames = FeatureWindow(sub_window_size, n_features, sub_window_size, 1, run_every=1)
+        self._frame_input = torch.zeros((1, sub_window_size, n_features), dtype=torch.float32)
+        self._frame_input_np = self._frame_input.numpy()
+        # one fixed (1, 5, 4) shape per push: a frozen trace saves the eager per-module overhead (~1/3 of the time)
+        with torch.inference_mode():
+            self._frame_model = torch.jit.freeze(torch.jit.trace(self.model, self._frame_input))
+        # score of the sub-window ending at each of the last stride * (n_sub_windows - 1) + 1 frames
+        self._scores = np.full(stride * (self.n_sub_windows - 1) + 1, np.nan, dtype=np.float32)
+        self._offsets = stride * np.arange(self.n_sub_windows - 1, -1, -1)
+        self.window_length = window_length
+        self.every = every
+        self._pushes = 0
+        self.probability = None
+        self.cache_misses = 0
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(CLFLSTM.from_torchscript(torch.jit.load(path, map_location='cpu')), **kwargs)
+
+    def push(self, features):
+        ''' Score the sub-window ending with this frame
+        :param features: Smoothed (ear, mar, puc, moe) of the frame, as pushed into the FeatureWindow
+        :return: Drowsiness probability (mean clipped score of the sub-windows of the window ending here),
+            None until a full window was pushed
+        '''
+        self._frames.push(features)
+        self._pushes += 1
+        score = np.nan
+        if self._frames.full and (self._pushes - self.window_length) % self.every == 0:
+            np.copyto(self._frame_input_np[0], self._frames.view())
+            with torch.inference_mode():
+                score = self._frame_model(self._frame_input).item()
+        self._scores[self._pushes % len(self._scores)] = score
+        if score == score: # not NaN
+            scores = self.cached_scores()
+            if not np.isnan(scores).any():
+                self.probability = float(scores.clip(0, 1).sum()) / self.n_sub_windows
+        return self.probability
+
+    def cached_scores(self):
+        ''' Cached scores of the sub-windows of the window ending at the newest frame, oldest first (NaN if missing) '''
+        return self._scores[(self._pushes - self._offsets) % len(self._scores)]
+
+    def reset(self):
+        ''' Forget the pushed frames, call it together with FeatureWindow.clear() '''
+        self._frames.clear()
+        self._pushes = 0
+        self._scores.fill(np.nan)
+        self.probability = None
+
+    def scores(self, input_data):
+        ''' Scores of the sub-windows of one feature window, from the cache when the window ends with the
+        last pushed frames, otherwise computed from scratch
+        :return: Array of shape (6,)
+        '''
+        window = input_data.view() if isinstance(input_data, FeatureWindow) else np.asarray(input_data, dtype=np.float32)
+        scores = self.cached_scores()
+        if len(window) and not np.isnan(scores).any() and np.array_equal(window[-self.sub_window_size:], self._frames.view()):
+            return scores
+        self.cache_misses += 1
+        np.copyto(self._input_np, sub_windows(window, self.sub_window_size, self.stride))
+        with torch.inference_mode():
+            return self.model(self._input).numpy().ravel()
+
+
+class WindowClassifier:
+    ''' Drowsiness classifier for models that score a whole feature window at once (HybridCNNLSTM).
+    Same interface as LSTMClassifier: one sigmoid score per window instead of six sub-window votes.
+    '''
+    def __init__(self, model, window_length=WINDOW_LENGTH, n_features=4, threshold=0.5, num_threads=None):
+        '''
+        :param model: Eager module (HybridCNNLSTM) taking (B, window_length, n_features) and returning (B, 1)
+        :param threshold: Score above which the window is classified drowsy
+        :param num_threads: Pin the torch intra-op thread count (None keeps the torch default)
+        '''
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.model = model.eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+        self.threshold = threshold
+        self._input = torch.zeros((1, window_length, n_features), dtype=torch.float32)
+        self._input_np = self._input.numpy()
+        self.last_scores = None
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(HybridCNNLSTM.from_torchscript(torch.jit.load(path, map_location='cpu')), **kwargs)
+
+    @property
+    def batch_model(self):
+        return self.model
+
+    def scores(self, input_data):
+        ''' Score one feature window
+        :param input_data: FeatureWindow, or feature window of shape (20, 4) as list or array
+        :return: Array of shape (1,) with the model output
+        '''
+        np.copyto(self._input_np[0], input_data.view() if isinstance(input_data, FeatureWindow) else input_data)
+        with torch.inference_mode():
+            return self.model(self._input).numpy().ravel()
+
+    def classify(self, input_data):
+        self.last_scores = self.scores(input_data)
+        return int(self.last_scores[0] > self.threshold)
+
+    def scores_batch(self, windows):
+        '''
+        :param windows: Array of shape (B, 20, 4)
+        :return: Array of shape (B, 1)
+        '''
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(np.ascontiguousarray(windows, dtype=np.float32))).numpy()
+
+    def classify_batch(self, windows):
+        return self.labels(self.scores_batch(windows))
+
+    def labels(self, scores):
+        return (scores[:, 0] > self.threshold).astype(int)
+
+
+class BatchClassifier:
+    ''' Shares one classifier between several streams.
+    classify() calls made from different threads within max_wait seconds of each other are scored
+    with a single scores_batch() forward pass, each caller blocks until its own label is ready.
+    last_scores holds the scores of the last classify() call of the calling thread (the stream it steps).
+    '''
+    def __init__(self, classifier, max_batch=16, max_wait=0.005):
+        '''
+        :param classifier: LSTMClassifier or WindowClassifier
+        :param max_batch: Largest number of windows scored in one pass
+        :param max_wait: Seconds the first request of a batch waits for more requests
+        '''
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.windows = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._local = threading.local()
+        self._thread = threading.Thread(target=self._loop, name='batch-classifier', daemon=True)
+        self._thread.start()
+
+    @property
+    def last_scores(self):
+        return getattr(self._local, 'scores', None)
+
+    def classify(self, input_data):
+        ''' Same contract as LSTMClassifier.classify, safe to call from any thread
+        :param input_data: FeatureWindow, or feature window of shape (20, 4)
+        :return: 1 for drowsy, 0 for normal
+        '''
+        window = np.array(input_data.view() if isinstance(input_data, FeatureWindow) else input_data, dtype=np.float32)
+        request = [window, threading.Event(), None, None]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BatchClassifier is closed')
+            self._pending.append(request)
+            self._cond.notify()
+        request[1].wait()
+        if isinstance(request[2], Exception):
+            raise request[2]
+        self._local.scores = request[3]
+        return request[2]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                deadline = time.perf_counter() + self.max_wait
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                scores = self.classifier.scores_batch(np.stack([request[0] for request in batch]))
+                for request, label, row in zip(batch, self.classifier.labels(scores), scores):
+                    request[2] = int(label)
+                    request[3] = row
+            except Exception as e:
+                for request in batch:
+                    request[2] = e
+            self.batches += 1
+            self.windows += len(batch)
+            for request in batch:
+                request[1].set()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(1)
@@ -0,0 +1,257 @@
+import json
+import numpy as np
+from window import FeatureWindow
+
+SENTINEL = -1000 # feature value of a frame without face
+
+# Decision thresholds, override them per deployment with a JSON file (load_config) or DrowsinessState(config=...)
+DEFAULT_CONFIG = {
+    'decay': 0.9,                     # EMA decay used to smoothen the noise in feature values
+    'count_detect_drownsiness': 6,    # consecutive drowsy decisions that trigger the alert
+    'pitch_up': 0.25,                 # calibrated pitch above / below which the head counts as down (face detected)
+    'pitch_down': -0.2,
+    'pitch_up_lost': 0.2,             # same while the face is lost, the face is often lost because the head is down
+    'pitch_down_lost': -0.15,
+    'head_frames': 20,                # consecutive head-down frames that trigger the alert
+}
+
+def load_config(path=None, **overrides):
+    ''' Decision thresholds: DEFAULT_CONFIG updated with a JSON file and keyword overrides '''
+    config = dict(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    config.update(overrides)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError('unknown decision settings: %s' % ', '.join(sorted(unknown)))
+    return config
+
+def ema_scan(x, reset, decay, initial, block=64):
+    ''' Vectorized y[t] = decay * y[t-1] + (1 - decay) * x[t], restarted with y[t] = x[t] where reset[t]
+    :param x: Array of shape (N, F)
+    :param reset: Bool array (N,)
+    :param initial: EMA value (F,) before the first frame
+    :param block: Frames solved at once with a (block, block) weight matrix, decay ** -block must stay representable
+    :return: Array of shape (N, F)
+    '''
+    n, n_features = x.shape
+    n_blocks = -(-n // block)
+    pad = n_blocks * block - n
+    b = np.concatenate([np.where(reset[:, None], x, (1 - decay) * x), np.zeros((pad, n_features))]).reshape(n_blocks, block, n_features)
+    resets = np.concatenate([reset, np.zeros(pad, dtype=bool)]).reshape(n_blocks, block)
+    # last reset at or before t inside the block (-1 if none): y[t] only depends on b[k] for k >= last reset
+    steps = np.arange(block)
+    last = np.maximum.accumulate(np.where(resets, steps, -1), axis=1)
+    lag = steps[:, None] - steps[None, :]
+    weights = np.where(lag >= 0, decay ** np.maximum(lag, 0), 0.0)[None] * (steps[None, None, :] >= last[:, :, None])
+    inner = weights @ b
+    carry_weight = np.where(last < 0, decay ** (steps + 1), 0.0)
+    y = np.empty_like(inner)
+    carry = np.asarray(initial, dtype=np.float64)
+    for i in range(n_blocks): # carry between blocks, n / block iterations
+        y[i] = inner[i] + carry_weight[i][:, None] * carry
+        carry = y[i, -1]
+    return y.reshape(-1, n_features)[:n]
+
+def run_length(increment, start=0):
+    ''' Counter that increments where increment is True and restarts from 0 elsewhere
+    :param start: Counter value before the first element
+    '''
+    index = np.arange(1, len(increment) + 1)
+    zeros = np.maximum.accumulate(np.where(increment, 0, index))
+    return np.where(zeros == 0, index + start, index - zeros)
+
+
+class DrowsinessState:
+    ''' Per-frame decision logic shared by the live loop (infer) and offline replay.
+    Normalizes the features with the calibration values, smooths them with an EMA, feeds the
+    LSTM window, counts drowsy decisions and head-down frames and sets the alert flag.
+    The smoothed features are one NumPy vector; step_many() runs the same logic over a whole recording at once.
+    '''
+    def __init__(self, ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm,
+                 classify, count_detect_drownsiness=None, decay=None, stream=None, config=None, classify_batch=None):
+        '''
+        :param ears_norm: Normalization values (mean, std) for eye feature
+        :param mars_norm: Normalization values for mouth feature
+        :param pucs_norm: Normalization values for pupil feature
+        :param moes_norm: Normalization values for mouth over eye feature
+        :param pitch_pred_norm: Calibrated pitch baseline
+        :param classify: Function window -> 1 (drowsy) / 0 (normal)
+        :param count_detect_drownsiness: Consecutive drowsy decisions that trigger the alert (overrides config)
+        :param decay: EMA decay used to smoothen the noise in feature values (overrides config)
+        :param stream: Optional StreamingClassifier fed with every frame, sets probability after every step
+        :param config: Decision thresholds (see DEFAULT_CONFIG / load_config)
+        :param classify_batch: Optional function (B, 20, 4) windows -> (B,) labels used by step_many
+        '''
+        self.config = load_config(**(config or {}))
+        if count_detect_drownsiness is not None:
+            self.config['count_detect_drownsiness'] = count_detect_drownsiness
+        if decay is not None:
+            self.config['decay'] = decay
+        self.set_norms(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm)
+        self.classify = classify
+        self.classify_batch = classify_batch
+        self.stream = stream
+
+        self.features = np.zeros(4) # smoothed, normalized ear, mar, puc, moe
+        self._raw = np.zeros(4)
+        self.pitch_main = 0
+        self.yaw_main = 0
+        self.roll_main = 0
+        self.head = 0
+        self.head_count = 0
+        self.label = None
+        self.count_decision = 0
+        self.classified = False # True if the classifier ran in the last step
+        self.alert = False
+        self.probability = None # per-frame drowsiness probability of the streaming classifier
+        self.window = FeatureWindow() # 20-frame feature window, also schedules the classification every 15 frames
+
+    ear_main = property(lambda self: float(self.features[0]))
+    mar_main = property(lambda self: float(self.features[1]))
+    puc_main = property(lambda self: float(self.features[2]))
+    moe_main = property(lambda self: float(self.features[3]))
+
+    @property
+    def count_detect_drownsiness(self):
+        return self.config['count_detect_drownsiness']
+
+    @property
+    def decay(self):
+        return self.config['decay']
+
+    def step(self, ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, detected):
+        ''' Process the raw features of one frame
+        :param detected: Whether a face was found in this frame
+        :return: Alert flag
+        '''
+        config = self.config
+        if ear != SENTINEL:
+            raw = self._raw
+            raw[0], raw[1], raw[2], raw[3] = ear, mar, puc, moe
+            raw -= self.norms[0]
+            raw /= self.norms[1]
+            self.pitch_main = pitch_pred - self.pitch_pred_norm
+            if self.features[0] == SENTINEL:
+                self.features[:] = raw
+            else:
+                raw *= 1 - config['decay']
+                self.features *= config['decay']
+                self.features += raw
+        else:
+            self.features[:] = SENTINEL
+
+        if detected:
+            self.head = int(self.pitch_main > config['pitch_up'] or self.pitch_main < config['pitch_down'])
+            self.head_count = self.head_count + 1 if self.head else 0
+        elif self.pitch_main > config['pitch_up_lost'] or self.pitch_main < config['pitch_down_lost']:
+            self.head_count += 1
+        else:
+            self.head_count = 0
+
+        self.classified = self.window.push(self.features)
+        if self.stream is not None:
+            self.probability = self.stream.push(self.features)
+        if self.classified:
+            self.label = self.classify(self.window) # 1 is drowsiness, 0 is normal
+            if self.label == 0:
+                self.count_decision = 0 # Reset count_decision if predict no drownsiness
+            else:
+                self.count_decision += 1
+
+        # Turn Alert
+        self.alert = self._alert(self.count_decision, self.head, self.head_count)
+        return self.alert
+
+    def _alert(self, count_decision, head, head_count):
+        return (count_decision >= self.config['count_detect_drownsiness']) | \
+            ((head == 1) & (head_count >= self.config['head_frames']))
+
+    def step_many(self, features, poses, detected):
+        ''' Process a whole recording at once, same result as calling step() on every frame
+        :param features: Raw (ear, mar, puc, moe) of shape (N, 4), SENTINEL where no face was found
+        :param poses: (pitch, yaw, roll) of shape (N, 3)
+        :param detected: Face detection mask (N,)
+        :return: Dict of per-frame columns: ear_main, mar_main, puc_main, moe_main, pitch_main, head, head_count,
+            classified, label (-1 before the first classification), count_decision, alert
+        '''
+        config = self.config
+        features = np.asarray(features, dtype=np.float64)
+        detected = np.asarray(detected, dtype=bool)
+        n_frames = len(features)
+        if n_frames == 0:
+            return {}
+        face = features[:, 0] != SENTINEL
+
+        # EMA, restarted on the first frame with a face after a frame without
+        previous = np.concatenate(([self.features[0] == SENTINEL], ~face[:-1]))
+        smoothed = ema_scan((features - self.norms[0]) / self.norms[1], face & previous, config['decay'],
+                            np.where(self.features == SENTINEL, 0, self.features))
+        smoothed[~face] = SENTINEL
+
+        # pitch of the last frame with a face, head flag of the last frame with detected
+        last_face = np.maximum.accumulate(np.where(face, np.arange(n_frames), -1))
+        pitch_main = np.where(last_face >= 0, np.asarray(poses)[np.maximum(last_face, 0), 0] - self.pitch_pred_norm, self.pitch_main)
+        down = (pitch_main > config['pitch_up']) | (pitch_main < config['pitch_down'])
+        down_lost = (pitch_main > config['pitch_up_lost']) | (pitch_main < config['pitch_down_lost'])
+        last_detected = np.maximum.accumulate(np.where(detected, np.arange(n_frames), -1))
+        head = np.where(last_detected >= 0, down[np.maximum(last_detected, 0)], self.head).astype(np.int8)
+        head_count = run_length(np.where(detected, down, down_lost), self.head_count)
+
+        # classification schedule of the FeatureWindow, all due windows scored in one batch
+        window = self.window
+        first = max(window.run_every - window.frame_before_run, window.length - window.count, 1)
+        due = np.arange(first - 1, n_frames, window.run_every)
+        if len(due) == 0:
+            labels = np.zeros(0, dtype=int)
+        else:
+            history = np.concatenate([window.view(), smoothed.astype(window.view().dtype)])
+            windows = np.lib.stride_tricks.sliding_window_view(history, window.length, axis=0)[due + window.count - window.length + 1]
+            windows = np.swapaxes(windows, 1, 2)
+        if len(due) and self.classify_batch is not None:
+            labels = np.asarray(self.classify_batch(np.ascontiguousarray(windows)), dtype=int)
+        elif len(due):
+            labels = np.array([self.classify(w) for w in windows], dtype=int)
+
+        classified = np.zeros(n_frames, dtype=bool)
+        classified[due] = True
+        counts = run_length(labels == 1, self.count_decision) if len(due) else labels
+        event = np.maximum.accumulate(np.where(classified, np.cumsum(classified) - 1, -1))
+        count_decision = np.where(event >= 0, counts[np.maximum(event, 0)] if len(due) else 0, self.count_decision)
+        label = np.where(event >= 0, labels[np.maximum(event, 0)] if len(due) else 0,
+                         -1 if self.label is None else self.label).astype(np.int8)
+        alert = self._alert(count_decision, head, head_count)
+
+        # leave the state as if every frame had been stepped
+        frame_before_run = n_frames - 1 - due[-1] if len(due) else window.frame_before_run + n_frames
+        for row in smoothed[-window.length:]:
+            window.push(row)
+        window.frame_before_run = int(frame_before_run)
+        if self.stream is not None:
+            for row in smoothed:
+                self.probability = self.stream.push(row)
+        self.features[:] = smoothed[-1]
+        self.pitch_main = float(pitch_main[-1])
+        self.head = int(head[-1])
+        self.head_count = int(head_count[-1])
+        self.count_decision = int(count_decision[-1])
+        self.label = None if label[-1] == -1 else int(label[-1])
+        self.classified = bool(classified[-1])
+        self.alert = bool(alert[-1])
+        return {'ear_main': smoothed[:, 0], 'mar_main': smoothed[:, 1], 'puc_main': smoothed[:, 2],
+                'moe_main': smoothed[:, 3], 'pitch_main': pitch_main, 'head': head, 'head_count': head_count,
+                'classified': classified, 'label': label, 'count_decision': count_decision, 'alert': alert}
+
+    def set_norms(self, ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm):
+        ''' Replace the calibration values, e.g. with the online refined ones (RunningStats.norms()) '''
+        self.norms = np.array([ears_norm, mars_norm, pucs_norm, moes_norm], dtype=np.float64).T # (mean, std) x 4
+        self.pitch_pred_norm = pitch_pred_norm
+        self.yaw_pred_norm = yaw_pred_norm
+        self.roll_pred_norm = roll_pred_norm
+
+    def pause(self):
+        ''' Reset the counters while inference is switched off (running_inference is False) '''
+        self.count_decision = 0
+        self.head_count = 0
+        self.alert = False
@@ -0,0 +1,116 @@
+import os
+import select
+import threading
+import time
+import tty
+from serial_link import ANGLES, BUTTONS, READY, FrameDecoder, encode_frame
+
+class FakeArduino:
+    ''' Emulates sketch_nov14a.ino on a pseudo terminal so the serial link can run without hardware (POSIX only).
+    Open `port` with serial.Serial / SerialLink like a real device.
+    Like the sketch, every received command is answered with the current servo angles.
+    '''
+    def __init__(self, angle_x=135, angle_y=135, protocol='binary'):
+        '''
+        :param protocol: 'binary' like sketch_nov14a.ino, or 'text' like the sketches before the binary protocol
+        '''
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.angle_x = angle_x
+        self.angle_y = angle_y
+        self.alert = False
+        self.protocol = protocol
+        self.commands = []
+        self.bytes_received = 0
+        self._decoder = FrameDecoder()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='fake-arduino', daemon=True)
+
+    def start(self):
+        if self.protocol == 'binary':
+            self._send(READY, self.angle_x, self.angle_y) # the sketch reports its angles on startup
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def press_button(self, button):
+        ''' Simulate a button interrupt
+        :param button: 1 toggles running ("10"), 2 toggles running_inference ("01")
+        '''
+        if self.protocol == 'binary':
+            self._send(BUTTONS, int(button == 1), int(button == 2))
+        else:
+            self._println("10" if button == 1 else "01")
+
+    def _println(self, line):
+        os.write(self._master, (line + "\r\n").encode('utf-8'))
+
+    def _send(self, kind, a, b):
+        os.write(self._master, encode_frame(kind, a, b))
+
+    def _handle_frame(self, kind, target_x, target_y):
+        self._send(ANGLES, self.angle_x, self.angle_y)
+        self._apply(kind & 0x01, target_x, target_y)
+
+    def _handle(self, line):
+        self._println(f"{self.angle_x},{self.angle_y}")
+        parts = line.split(',')
+        if len(parts) != 3:
+            return
+        try:
+            alert, target_x, target_y = map(int, parts)
+        except ValueError:
+            return
+        self._apply(alert, target_x, target_y)
+
+    def _apply(self, alert, target_x, target_y):
+        self.commands.append((alert, target_x, target_y))
+        self.alert = alert == 1
+        # servos reach their target before the next command is answered
+        self.angle_x, self.angle_y = target_x, target_y
+
+    def _loop(self):
+        buffer = b''
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            self.bytes_received += len(data)
+            if self.protocol == 'binary':
+                for frame in self._decoder.feed(data):
+                    self._handle_frame(*frame)
+                continue
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self._handle(line.decode('utf-8', errors='ignore').strip())
+
+
+if __name__ == "__main__":
+    # Smoke test of SerialLink against the emulated device
+    from serial_link import SerialLink
+
+    device = FakeArduino().start()
+    link = SerialLink(device.port).start()
+    for i in range(100):
+        link.send(i % 2, 90 + i % 10, 90)
+    time.sleep(0.5)
+    device.press_button(1)
+    device.press_button(2)
+    time.sleep(0.5)
+    print('sent', link.commands_sent, 'coalesced', link.commands_coalesced, 'received by device', len(device.commands),
+          'bytes', device.bytes_received)
+    print('last command', device.commands[-1])
+    print('events', link.poll_events())
+    link.close()
+    device.close()
@@ -0,0 +1,50 @@
+import numpy as np
+
+right_eye = [[33, 133], [160, 144], [159, 145], [158, 153]] # right eye landmark positions
+left_eye = [[263, 362], [387, 373], [386, 374], [385, 380]] # left eye landmark positions
+mouth = [[61, 291], [39, 181], [0, 17], [269, 405]] # mouth landmark coordinates
+
+def _perimeter_pairs(eye):
+    # eight perimeter edges of the pupil polygon (same order as pupil_circularity)
+    return [(eye[0][0], eye[1][0]), (eye[1][0], eye[2][0]), (eye[2][0], eye[3][0]), (eye[3][0], eye[0][1]),
+            (eye[0][1], eye[3][1]), (eye[3][1], eye[2][1]), (eye[2][1], eye[1][1]), (eye[1][1], eye[0][0])]
+
+# Every distance needed for one frame, gathered once:
+#  0:3   widths D of left eye, right eye, mouth
+#  3:12  heights N1..N3 of left eye, right eye, mouth
+#  12:28 pupil perimeter edges of left eye, right eye
+#  28:30 pupil diameters of left eye, right eye
+_PAIRS = np.array([left_eye[0], right_eye[0], mouth[0]] +
+                  left_eye[1:] + right_eye[1:] + mouth[1:] +
+                  _perimeter_pairs(left_eye) + _perimeter_pairs(right_eye) +
+                  [(left_eye[1][0], left_eye[3][1]), (right_eye[1][0], right_eye[3][1])], dtype=np.intp)
+_PAIR_A = _PAIRS[:, 0]
+_PAIR_B = _PAIRS[:, 1]
+
+def pair_distances(landmarks):
+    ''' Calculate all distances used by the facial features in one pass
+    :param landmarks: Landmark array of shape (468, 2) or stacked (N, 468, 2). Extra coordinates (z) are ignored
+    :return: Array of shape (30,) or (N, 30) with the euclidean distances of every landmark pair
+    '''
+    landmarks = np.asarray(landmarks, dtype=np.float64)[..., :2]
+    return np.linalg.norm(landmarks[..., _PAIR_A, :] - landmarks[..., _PAIR_B, :], axis=-1)
+
+def landmark_features(landmarks):
+    ''' Calculate EAR, MAR, PUC and MOE for one frame or a whole recording
+    :param landmarks: Landmark array of shape (468, 2) or stacked (N, 468, 2), in pixel coordinates
+    :return: Array of shape (4,) or (N, 4) holding [ear, mar, puc, moe]
+    '''
+    d = pair_distances(landmarks)
+    batch = d.shape[:-1]
+
+    # aspect ratios (N1 + N2 + N3) / (3 * D) of left eye, right eye and mouth
+    ratios = d[..., 3:12].reshape(batch + (3, 3)).sum(axis=-1) / (3 * d[..., 0:3])
+    # pupil circularity 4 * pi * area / perimeter ** 2 with area = pi * (diameter / 2) ** 2
+    circularity = (4 * np.pi) * (np.pi * (d[..., 28:30] * 0.5) ** 2) / d[..., 12:28].reshape(batch + (2, 8)).sum(axis=-1) ** 2
+
+    features = np.empty(batch + (4,))
+    features[..., 0] = (ratios[..., 0] + ratios[..., 1]) / 2
+    features[..., 1] = ratios[..., 2]
+    features[..., 2] = (circularity[..., 0] + circularity[..., 1]) / 2
+    features[..., 3] = features[..., 1] / features[..., 0]
+    return features
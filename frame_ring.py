@@ -0,0 +1,208 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+class FrameRing:
+    ''' Frame slots in shared memory with sequence numbers and latest-frame-wins semantics.
+    The header holds the sequence number of the frame in every slot (-1 while it is being written),
+    the last written and the last claimed sequence number. Frames are captured straight into a slot and
+    read in place by other processes, which check the slot sequence number again after reading (seqlock)
+    to detect a frame that was overwritten meanwhile.
+    '''
+    def __init__(self, shape, slots=4, dtype=np.uint8, name=None):
+        '''
+        :param shape: Frame shape, e.g. (720, 1280, 3)
+        :param slots: Number of frames kept, must exceed the number of readers
+        :param name: Name of an existing ring to attach to, None to create a new one
+        '''
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+        frame_bytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        header_bytes = 8 * (slots + 2)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=header_bytes + slots * frame_bytes)
+        self.header = np.ndarray((slots + 2,), dtype=np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=dtype, buffer=self.shm.buf, offset=header_bytes)
+        if self.owner:
+            self.header[:slots] = -1
+            self.header[slots:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def latest(self):
+        return int(self.header[self.slots])
+
+    def capture(self, cap):
+        ''' Read the next camera frame directly into a free slot (no copy)
+        :param cap: cv2.VideoCapture delivering frames of the ring shape
+        :return: Sequence number of the frame, None if the read failed
+        '''
+        seq = self.latest + 1
+        slot = self.frames[seq % self.slots]
+        self.header[seq % self.slots] = -1
+        success, image = cap.read(slot)
+        if not success:
+            return None
+        if image.ctypes.data != slot.ctypes.data:
+            if image.shape != self.shape:
+                raise ValueError('camera delivers frames of shape %s, ring expects %s' % (image.shape, self.shape))
+            np.copyto(slot, image)
+        return self._publish(seq)
+
+    def write(self, image):
+        ''' Copy a frame into the next slot
+        :return: Sequence number of the frame
+        '''
+        seq = self.latest + 1
+        self.header[seq % self.slots] = -1
+        np.copyto(self.frames[seq % self.slots], image)
+        return self._publish(seq)
+
+    def _publish(self, seq):
+        self.header[seq % self.slots] = seq
+        self.header[self.slots] = seq
+        return seq
+
+    def valid(self, seq):
+        ''' Whether the slot of seq still holds that frame '''
+        return self.header[seq % self.slots] == seq
+
+    def read(self, seq):
+        ''' In-place view of a frame, None if it was already overwritten. Check valid(seq) again after using it '''
+        return self.frames[seq % self.slots] if self.valid(seq) else None
+
+    def claim(self, lock):
+        ''' Take the newest frame no other reader has taken yet
+        :param lock: multiprocessing.Lock shared by the readers
+        :return: Sequence number, or None if there is no new frame
+        '''
+        with lock:
+            seq = self.latest
+            if seq > self.header[self.slots + 1] and self.valid(seq):
+                self.header[self.slots + 1] = seq
+                return seq
+        return None
+
+    def close(self):
+        del self.header, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def facemesh_worker(ring_name, shape, slots, lock, results, stop):
+    ''' FaceMesh worker process: claims the newest frame of the ring and sends back
+    (seq, landmarks) with the normalized landmarks as a (468, 2) float32 array, or None if no face was found
+    '''
+    import cv2
+    from model_registry import load_face_mesh
+    from roi import landmark_array
+
+    face_mesh = load_face_mesh()
+    ring = FrameRing(shape, slots, name=ring_name)
+    rgb = np.empty(shape, dtype=np.uint8)
+    try:
+        while not stop.is_set():
+            seq = ring.claim(lock)
+            if seq is None:
+                time.sleep(0.001)
+                continue
+            cv2.cvtColor(ring.frames[seq % slots], cv2.COLOR_BGR2RGB, dst=rgb)
+            if not ring.valid(seq):
+                continue # overwritten while it was converted
+            result = face_mesh.process(rgb)
+            landmarks = None
+            if result.multi_face_landmarks:
+                landmarks = landmark_array(result.multi_face_landmarks[0]).astype(np.float32)
+            results.put((seq, landmarks))
+    finally:
+        ring.close()
+
+
+class FaceMeshPool:
+    ''' FaceMesh on worker processes fed through a FrameRing.
+    The capture process only writes frames into shared memory and receives landmark arrays,
+    so FaceMesh and the Python feature code use all cores instead of sharing one GIL.
+    The ring and the workers are created on the first captured frame, with its actual shape.
+    '''
+    def __init__(self, workers=2, slots=None, worker=facemesh_worker):
+        '''
+        :param workers: Number of FaceMesh processes
+        :param slots: Ring slots (default workers + 3)
+        :param worker: Worker process function (ring_name, shape, slots, lock, results, stop)
+        '''
+        self.workers = workers
+        self.slots = slots or workers + 3
+        self.worker = worker
+        self.ring = None
+        self.processes = []
+        self.last_seq = 0
+        self.dropped = 0
+        self._context = mp.get_context('spawn') # no fork of the torch / mediapipe threads of the capture process
+
+    def _start(self, image):
+        self.ring = FrameRing(image.shape, self.slots)
+        self._lock = self._context.Lock()
+        self._results = self._context.Queue()
+        self._stop = self._context.Event()
+        for i in range(self.workers):
+            process = self._context.Process(target=self.worker, name='facemesh-%d' % i, daemon=True,
+                                            args=(self.ring.name, image.shape, self.slots, self._lock, self._results, self._stop))
+            process.start()
+            self.processes.append(process)
+
+    def capture(self, cap):
+        ''' Capture one frame into the ring
+        :return: Sequence number, None if the read failed
+        '''
+        if self.ring is None:
+            success, image = cap.read()
+            if not success:
+                return None
+            self._start(image)
+            return self.ring.write(image)
+        return self.ring.capture(cap)
+
+    def results(self, timeout=0):
+        ''' Landmarks finished since the last call, oldest first. Results older than one already returned are dropped
+        :param timeout: Seconds to wait for the first result
+        :return: List of (seq, landmarks or None)
+        '''
+        ready = []
+        try:
+            ready.append(self._results.get(timeout=timeout) if timeout else self._results.get_nowait())
+            while True:
+                ready.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        ready.sort(key=lambda result: result[0])
+        fresh = [result for result in ready if result[0] > self.last_seq]
+        self.dropped += len(ready) - len(fresh)
+        if fresh:
+            self.last_seq = fresh[-1][0]
+        return fresh
+
+    def frame(self, seq):
+        ''' Copy of a frame still in the ring (for rendering), None if it was overwritten '''
+        image = self.ring.read(seq)
+        if image is None:
+            return None
+        image = image.copy()
+        return image if self.ring.valid(seq) else None
+
+    def close(self):
+        if self.ring is None:
+            return
+        self._stop.set()
+        for process in self.processes:
+            process.join(2)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.ring.close()
+        self.ring = None
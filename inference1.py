@@ -1,107 +1,53 @@
 import cv2 
-import mediapipe as mp
-import math
 import numpy as np 
 import os 
 import time
-import torch
-import psutil
 import threading
 import queue
-import serial
-import pickle
 import warnings
+import argparse
+import signal
+from features import landmark_features
+from pipeline import Pipeline
+from serial_link import SerialLink
+from decision import DrowsinessState, load_config
+from calibration import calibration_stats, RunningStats, CalibrationStore
+from pose_regressor import normalize_poses, pose_features
+from metrics import metrics
+from model_registry import ModelRegistry, LSTM_MODELS, load_face_mesh, select_variant
+from roi import ROITracker, landmark_array
+from scheduler import AdaptiveScheduler
+from frame_ring import FaceMeshPool
+from recorder import Recorder
+from servo import ServoTracker
+
+startup_marks = {} # startup phase -> seconds since the process was started
+roi_tracker = None # ROITracker when FaceMesh runs on a crop around the face (--roi)
+face_pool = None # FaceMeshPool when FaceMesh runs on worker processes (--face-workers)
+recorder = None # Recorder of the decision state of every frame (--record)
+face_landmarks = None # normalized landmarks of the last frame, only kept when the recorder stores them
 
 def get_memory_usage():
+    import psutil
     process = psutil.Process(os.getpid())  
     mem_info = process.memory_info()       
     ram_usage = mem_info.rss / (1024 ** 2) 
     return ram_usage
 
-def distance(p1, p2):
-    ''' Calculate distance between two points
-    :param p1: First Point 
-    :param p2: Second Point
-    :return: Euclidean distance between the points. (Using only the x and y coordinates).
-    '''
-    p1 = np.array(p1)  # Chuyển đổi nếu p1 là list hoặc tuple
-    p2 = np.array(p2)  # Chuyển đổi nếu p2 là list hoặc tuple
-    return np.linalg.norm(p1 - p2)
-
-def eye_aspect_ratio(landmarks, eye):
-    ''' Calculate the ratio of the eye length to eye width. 
-    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
-    :param eye: List containing positions which correspond to the eye
-    :return: Eye aspect ratio value
-    '''
-    N1 = distance(landmarks[eye[1][0]], landmarks[eye[1][1]])
-    N2 = distance(landmarks[eye[2][0]], landmarks[eye[2][1]])
-    N3 = distance(landmarks[eye[3][0]], landmarks[eye[3][1]])
-    D = distance(landmarks[eye[0][0]], landmarks[eye[0][1]])
-    return (N1 + N2 + N3) / (3 * D)
-
-def eye_feature(landmarks):
-    ''' Calculate the eye feature as the average of the eye aspect ratio for the two eyes
-    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
-    :return: Eye feature value
-    '''
-    return (eye_aspect_ratio(landmarks, left_eye) + \
-    eye_aspect_ratio(landmarks, right_eye))/2
-
-def mouth_feature(landmarks):
-    ''' Calculate mouth feature as the ratio of the mouth length to mouth width
-    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
-    :return: Mouth feature value
-    '''
-    N1 = distance(landmarks[mouth[1][0]], landmarks[mouth[1][1]])
-    N2 = distance(landmarks[mouth[2][0]], landmarks[mouth[2][1]])
-    N3 = distance(landmarks[mouth[3][0]], landmarks[mouth[3][1]])
-    D = distance(landmarks[mouth[0][0]], landmarks[mouth[0][1]])
-    return (N1 + N2 + N3)/(3*D)
-
-def pupil_circularity(landmarks, eye):
-    ''' Calculate pupil circularity feature.
-    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
-    :param eye: List containing positions which correspond to the eye
-    :return: Pupil circularity for the eye coordinates
-    '''
-    perimeter = distance(landmarks[eye[0][0]], landmarks[eye[1][0]]) + \
-            distance(landmarks[eye[1][0]], landmarks[eye[2][0]]) + \
-            distance(landmarks[eye[2][0]], landmarks[eye[3][0]]) + \
-            distance(landmarks[eye[3][0]], landmarks[eye[0][1]]) + \
-            distance(landmarks[eye[0][1]], landmarks[eye[3][1]]) + \
-            distance(landmarks[eye[3][1]], landmarks[eye[2][1]]) + \
-            distance(landmarks[eye[2][1]], landmarks[eye[1][1]]) + \
-            distance(landmarks[eye[1][1]], landmarks[eye[0][0]])
-    area = math.pi * ((distance(landmarks[eye[1][0]], landmarks[eye[3][1]]) * 0.5) ** 2)
-    return (4*math.pi*area)/(perimeter**2)
-
-def pupil_feature(landmarks):
-    ''' Calculate the pupil feature as the average of the pupil circularity for the two eyes
-    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
-    :return: Pupil feature value
-    '''
-    return (pupil_circularity(landmarks, left_eye) + \
-        pupil_circularity(landmarks, right_eye))/2
+def mark_startup(phase):
+    ''' Record (once) the time from process start to a startup phase, e.g. the first decision '''
+    if phase in startup_marks:
+        return
+    import psutil
+    startup_marks[phase] = time.time() - psutil.Process(os.getpid()).create_time()
+    metrics.set('startup_seconds', startup_marks[phase], phase=phase)
+    print('Startup: %s after %.2f s' % (phase, startup_marks[phase]))
 
 def normalize_test(poses_array):
-    # poses_array: array với các giá trị theo thứ tự ['nose_x', 'nose_y', ..., 'mouth_right_y']
-    normalized_array = poses_array.copy()
-    # Indices của các feature trong array
-    
-    for dim_idx in [0, 1]:  # X và Y tương ứng là chỉ số chẵn/lẻ
-        # Centering around the nose
-        for feature_idx in range(dim_idx, 14, 2):
-            normalized_array[feature_idx] = poses_array[feature_idx] - poses_array[dim_idx]  # Trừ giá trị nose_x hoặc nose_y
-        
-        # Scaling
-        diff = poses_array[12 + dim_idx] - poses_array[4 + dim_idx]  # mouth_right_dim - left_eye_dim
-        for feature_idx in range(dim_idx, 14, 2):
-            normalized_array[feature_idx] = normalized_array[feature_idx] / diff
-
+    # poses_array: array với các giá trị theo thứ tự ['nose_x', 'nose_y', ..., 'mouth_right_y'], shape (14,) or (N, 14)
+    # Centering around the nose and scaling by mouth_right_dim - left_eye_dim, for X and Y at once
     # Tạo array 2D để phù hợp với đầu vào của mô hình
-    face_features_array = [normalized_array]
-    return face_features_array
+    return np.atleast_2d(normalize_poses(poses_array))
 
 
 def head_pose(face_features):
@@ -134,8 +80,95 @@ def draw_axes(img, pitch, yaw, roll, tx, ty, size=50):
     cv2.line(new_img, tuple(axes_points[:, 3].ravel()), tuple(axes_points[:, 2].ravel()), (0, 0, 255), 3)
     return new_img
 
-def run_face_mp(image, height, width, draw_face = True):
-    global alert, running, running_inference, arduino, servo_delta_x, servo_delta_y, current_servo_x, current_servo_y, detect
+def handle_button(flag1, flag2):
+    ''' Toggle the running flags from an Arduino button event ("10" or "01")
+    :param flag1: 1 if button 1 (running) was pressed
+    :param flag2: 1 if button 2 (running_inference) was pressed
+    '''
+    global alert, running, running_inference
+    # Kiểm tra giá trị và thay đổi các cờ
+    if flag2 == 1:
+        running_inference = not running_inference
+    if flag1 == 1:
+        running = not running
+        if running:
+            running_inference = True
+            alert = False
+
+def handle_event(kind, a, b):
+    ''' Apply one event received from the Arduino (see serial_link) '''
+    if kind == 'button':
+        handle_button(a, b)
+    elif kind == 'servo':
+        # Góc servo hiện tại do Arduino gửi về
+        servo_tracker.sync(a, b)
+    else:
+        # connected / ready: Arduino khởi động lại, gửi lại lệnh
+        servo_tracker.reconnected(a, b)
+
+def handle_arduino(delta_x, delta_y, timestamp = None):
+    ''' Apply the events received from the Arduino and queue the servo command for one frame. Never blocks.
+    :param delta_x: Horizontal offset of the nose from the image center (pixels), None if no face was detected
+    :param delta_y: Vertical offset of the nose from the image center (pixels), None if no face was detected
+    :param timestamp: Capture time of the frame (time.perf_counter), default now
+    '''
+    with metrics.timer('stage', stage='serial'):
+        _handle_arduino(delta_x, delta_y, timestamp)
+
+def _handle_arduino(delta_x, delta_y, timestamp):
+    for event in arduino.poll_events():
+        handle_event(*event)
+
+    # Servo bám theo mũi, chỉ gửi lệnh khi góc mục tiêu hoặc cảnh báo thay đổi
+    command = servo_tracker.update(None if delta_x is None else (delta_x, delta_y), alert, timestamp)
+    if command is not None:
+        arduino.send(*command) # only the newest pending command is written
+
+def run_face_mp(image, height, width, draw_face = True, serial_io = True, render = True):
+    ''' Run FaceMesh on one frame and extract the features
+    :param draw_face: Draw the face mesh contours on the returned frame
+    :param serial_io: Exchange events / servo commands with the Arduino for this frame
+    :param render: If False (headless) the frame is never written to: no RGB->BGR conversion back,
+        no drawing, and the input frame is returned as is
+    :return: ear, mar, puc, moe, pitch, yaw, roll and the (annotated) frame
+    '''
+    metrics.inc('frames_total')
+    mark_startup('first_frame')
+    with metrics.timer('stage', stage='bgr2rgb'):
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    rgb_image.flags.writeable = False
+    with metrics.timer('stage', stage='facemesh'):
+        if roi_tracker is None:
+            results = face_mesh.process(rgb_image)
+            face = results.multi_face_landmarks[0] if results.multi_face_landmarks else None
+        else:
+            face, landmarks_positions = roi_tracker.process(face_mesh, rgb_image, remap_landmarks=draw_face and render)
+
+    if not render:
+        # headless: keep the original frame read-only, nothing below draws on it
+        image.flags.writeable = False
+        draw_face = False
+    else:
+        # the RGB copy is ours, convert it back in place instead of allocating another frame
+        rgb_image.flags.writeable = True
+        with metrics.timer('stage', stage='rgb2bgr'):
+            image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR, dst=rgb_image)
+
+    if face is not None and roi_tracker is None:
+        # assume that only face is present in the image
+        landmarks_positions = landmark_array(face) # saving normalized landmark positions
+    elif face is None:
+        landmarks_positions = None
+    return run_landmarks(landmarks_positions, image, height, width, face=face if draw_face else None,
+                         serial_io=serial_io, render=render)
+
+def run_landmarks(landmarks_positions, image, height, width, face = None, serial_io = True, render = True):
+    ''' Head pose, features, drawing and servo tracking from the normalized FaceMesh landmarks of one frame
+    :param landmarks_positions: (468, 2) normalized landmarks, None if no face was found
+    :param face: FaceMesh landmark list to draw the mesh contours from, None to skip them
+    :return: ear, mar, puc, moe, pitch, yaw, roll and the (annotated) frame
+    '''
+    global detect, nose_position, face_landmarks
     NOSE = 1
     FOREHEAD = 10
     LEFT_EYE = 33
@@ -143,83 +176,43 @@ def run_face_mp(image, height, width, draw_face = True):
     CHIN = 199
     RIGHT_EYE = 263
     MOUTH_RIGHT = 291
-    face_features = []
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    image.flags.writeable = False
-    results = face_mesh.process(image)
-    
-    image.flags.writeable = True
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
     center_x, center_y = width // 2, height // 2
 
-    if results.multi_face_landmarks:
-        landmarks_positions = []
-        # assume that only face is present in the image
-        for idx, data_point in enumerate(results.multi_face_landmarks[0].landmark):
-            landmarks_positions.append([data_point.x, data_point.y]) # saving normalized landmark positions
-            if idx in [FOREHEAD, NOSE, MOUTH_LEFT, MOUTH_RIGHT, CHIN, LEFT_EYE, RIGHT_EYE]:
-                face_features.append(data_point.x)
-                face_features.append(data_point.y)
-        
-        landmarks_positions = np.array(landmarks_positions)
-        pitch_pred, yaw_pred, roll_pred = head_pose(face_features)
+    if landmarks_positions is not None:
+        metrics.inc('faces_detected_total')
+        # [FOREHEAD, NOSE, MOUTH_LEFT, MOUTH_RIGHT, CHIN, LEFT_EYE, RIGHT_EYE] in landmark order
+        face_features = pose_features(landmarks_positions)
+        with metrics.timer('stage', stage='head_pose'):
+            pitch_pred, yaw_pred, roll_pred = head_pose(face_features)
+        if recorder is not None and recorder.landmarks:
+            face_landmarks = landmarks_positions.astype(np.float32)
 
         landmarks_positions[:, 0] *= width
         landmarks_positions[:, 1] *= height
 
         # draw face mesh over image
-        if draw_face:
-            for face_landmarks in results.multi_face_landmarks:
-                    mp_drawing.draw_landmarks(
-                        image=image,
-                        landmark_list=face_landmarks,
-                        connections=mp_face_mesh.FACEMESH_CONTOURS,
-                        landmark_drawing_spec=drawing_spec,
-                        connection_drawing_spec=drawing_spec)
+        if face is not None and render:
+            with metrics.timer('stage', stage='draw_landmarks'):
+                mp_drawing.draw_landmarks(
+                    image=image,
+                    landmark_list=face,
+                    connections=mp_face_mesh.FACEMESH_CONTOURS,
+                    landmark_drawing_spec=drawing_spec,
+                    connection_drawing_spec=drawing_spec)
         
         Nose_x = int(landmarks_positions[NOSE][0])
         Nose_y = int(landmarks_positions[NOSE][1])
 
-        image = draw_axes(image, pitch_pred, yaw_pred, roll_pred, Nose_x, Nose_y)
+        if render:
+            with metrics.timer('stage', stage='draw_axes'):
+                image = draw_axes(image, pitch_pred, yaw_pred, roll_pred, Nose_x, Nose_y)
 
-        delta_x = Nose_x - center_x
-        delta_y = Nose_y - center_y
+        nose_position = (Nose_x, Nose_y)
+        if serial_io:
+            handle_arduino(Nose_x - center_x, Nose_y - center_y)
 
-        # Chuyển đổi khoảng lệch thành độ servo
-        
-        if arduino.in_waiting > 0:
-            data = arduino.readline().decode('utf-8').strip()  # Đọc và giải mã dòng dữ liệu
-            if data.count(",") == 1:
-                current_servo_x, current_servo_y = map(int, data.split(','))
-                servo_delta_x = np.interp(delta_x, [-width // 2, width // 2], [5, -5])
-                servo_delta_y = np.interp(delta_y, [-height // 2, height // 2], [5, -5])
-
-                # Cập nhật góc servo
-                current_servo_x = max(0, min(current_servo_x + servo_delta_x, 180))  
-                current_servo_y = max(0, min(current_servo_y + servo_delta_y, 180))
-            elif data in ['01', '10']:
-                flag1 = int(data[0])
-                flag2 = int(data[1])
-                # Kiểm tra giá trị và thay đổi các cờ
-                if flag2 == 1:
-                    running_inference = not running_inference
-                if flag1 == 1:
-                    running = not running
-                    if running:
-                        running_inference = True
-                        alert = False
-
-        # Giảm rung lắc nếu chuyển động nhỏ
-        threshold = 10  # Ngưỡng (số pixel)
-        if abs(delta_x) > threshold or abs(delta_y) > threshold:
-            # Gửi lệnh đến Arduino
-            data = f"{int(alert)},{int(current_servo_x)},{int(current_servo_y)}\n"
-            arduino.write(data.encode('utf-8'))
-
-        ear = eye_feature(landmarks_positions)
-        mar = mouth_feature(landmarks_positions)
-        puc = pupil_feature(landmarks_positions)
-        moe = mar/ear
+        with metrics.timer('stage', stage='features'):
+            ear, mar, puc, moe = landmark_features(landmarks_positions)
         detect = True
     else:
         ear = -1000
@@ -227,12 +220,49 @@ def run_face_mp(image, height, width, draw_face = True):
         puc = -1000
         moe = -1000
         pitch_pred, yaw_pred, roll_pred = 0, 0, 0
+        nose_position = None
+        face_landmarks = None
+        if serial_io:
+            handle_arduino(None, None)
         detect = False
    
     return ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image
 
-
-def calibrate(calib_frame_count=150, frames_start = 60):
+def run_face_pool(cap, height, width, serial_io = True, render = True):
+    ''' Capture one frame into the shared-memory ring of face_pool and process the landmarks
+    the FaceMesh workers finished meanwhile (zero, one or several frames, oldest first)
+    :return: List of (run_landmarks output, detected, landmarks for the recorder), detect and face_landmarks
+        only hold the values of the last frame
+    '''
+    with metrics.timer('stage', stage='capture'):
+        seq = face_pool.capture(cap)
+    if seq is None:
+        metrics.inc('empty_frames_total')
+        print("Ignoring empty camera frame.")
+    outputs = []
+    for seq, landmarks_positions in face_pool.results():
+        metrics.inc('frames_total')
+        mark_startup('first_frame')
+        image = None
+        if render:
+            image = face_pool.frame(seq)
+            if image is None: # overwritten by newer frames, keep the window alive
+                image = np.zeros((height, width, 3), dtype=np.uint8)
+        if landmarks_positions is not None:
+            landmarks_positions = landmarks_positions.astype(np.float64)
+        result = run_landmarks(landmarks_positions, image, height, width, serial_io=serial_io, render=render)
+        outputs.append((result, detect, face_landmarks))
+    return outputs
+
+
+def calibrate(calib_frame_count=150, frames_start = 60, render = True, min_calib_samples = 50):
+    ''' Collect the features of the driver in neutral state and compute the normalization values
+    :param render: Show the calibration frames. If False (headless) no window is opened
+    :param min_calib_samples: Frames with a face needed, calibration goes on past calib_frame_count
+        until that many were collected
+    :return: Normalization values (None if the calibration was stopped before it finished) and the number of
+        frames with a face they were computed from
+    '''
 
     ears = []
     mars = []
@@ -247,284 +277,474 @@ def calibrate(calib_frame_count=150, frames_start = 60):
     cap.set(3, width)
     cap.set(4, height)
     frames = 0
+    done = False
+    finished = False
     
-    while True:
-        success, image = cap.read()
-        if not success:
-            print("Ignoring empty camera frame.")
-            continue
-        frames +=1
-        ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image = run_face_mp(image, height=height, width=width)
-        if ear != -1000 and frames > frames_start:
-            ears.append(ear)
-            mars.append(mar)
-            pucs.append(puc)
-            moes.append(moe)
-            pitch_preds.append(pitch_pred)
-            yaw_preds.append(yaw_pred)
-            roll_preds.append(roll_pred)
-
-        cv2.putText(image, "Calibration", (int(0.02*image.shape[1]), int(0.14*image.shape[0])),
-                cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 0, 0), 2)
-        cv2.imshow('MediaPipe FaceMesh', image)
-        if cv2.waitKey(5) & 0xFF == ord("q"):
-            break
-        if frames >= frames_start + calib_frame_count:
-            break
-    
-    cv2.destroyAllWindows()
+    # only a shutdown signal ends it early, the run / stop button is ignored until the driver is calibrated
+    while not stop_thread and not done:
+        if face_pool is not None:
+            outputs = run_face_pool(cap, height, width, render=render)
+        else:
+            success, image = cap.read()
+            if not success:
+                print("Ignoring empty camera frame.")
+                continue
+            outputs = [(run_face_mp(image, height=height, width=width, render=render), detect, face_landmarks)]
+        for (ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image), detected, landmarks in outputs:
+            frames +=1
+            if recorder is not None:
+                recorder.write(None, detected, landmarks=landmarks, mode='calibration')
+            if ear != -1000 and frames > frames_start:
+                ears.append(ear)
+                mars.append(mar)
+                pucs.append(puc)
+                moes.append(moe)
+                pitch_preds.append(pitch_pred)
+                yaw_preds.append(yaw_pred)
+                roll_preds.append(roll_pred)
+
+            if render:
+                cv2.putText(image, "Calibration", (int(0.02*image.shape[1]), int(0.14*image.shape[0])),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 0, 0), 2)
+                cv2.imshow('MediaPipe FaceMesh', image)
+                if cv2.waitKey(5) & 0xFF == ord("q"):
+                    done = True
+                    break
+            if frames >= frames_start + calib_frame_count and len(ears) >= min_calib_samples:
+                done = finished = True
+                break
+
+    if render:
+        cv2.destroyAllWindows()
     cap.release()
-    ears = np.array(ears)
-    mars = np.array(mars)
-    pucs = np.array(pucs)
-    moes = np.array(moes)
-
-    pitch_preds = np.array(pitch_preds)
-    pitch_mean_zscore = pitch_preds.mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
-
-    yaw_preds = np.array(yaw_preds)
-    yaw_mean_zscore = yaw_preds.mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
-
-    roll_preds = np.array(roll_preds)
-    roll_mean_zscore = roll_preds.mean()  # Lấy giá trị trung bình sau khi chuẩn hóa
-
-    return [ears.mean(), ears.std()], [mars.mean(), mars.std()], \
-        [pucs.mean(), pucs.std()], [moes.mean(), moes.std()], \
-        pitch_mean_zscore, yaw_mean_zscore, roll_mean_zscore
+    if not finished:
+        return None, len(ears)
+    return calibration_stats(ears, mars, pucs, moes, pitch_preds, yaw_preds, roll_preds), len(ears)
 
 def get_classification(input_data):
     ''' Perform classification over the facial  features.
-    :param input_data: List of facial features for 20 frames
+    :param input_data: FeatureWindow (or list) of facial features for 20 frames
     :return: Alert / Drowsy state prediction
     '''
-    model_input = []
-    model_input.append(input_data[0:5])
-    model_input.append(input_data[3:8])
-    model_input.append(input_data[6:11])
-    model_input.append(input_data[9:14])
-    model_input.append(input_data[12:17])
-    model_input.append(input_data[15:20])
-    
-    model_input = [input_data[i:i+5] for i in range(0, 16, 3)]
-    model_input = torch.FloatTensor(np.array(model_input))
-    with torch.no_grad():
-        preds = model(model_input)
-        preds = (preds > 0.5).int().cpu().numpy()
-    return int(preds.sum() >= 5)
-
-def infer(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm, count_detect_drownsiness = 6):
+    with metrics.timer('stage', stage='lstm'):
+        return classifier.classify(input_data)
+
+def infer(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm, count_detect_drownsiness = None,
+          pipelined = False, render = True, profile = None, max_drift = 3.0, min_drift_samples = 150, scheduler = None,
+          decision_config = None):
     ''' Perform inference.
     :param ears_norm: Normalization values for eye feature
     :param mars_norm: Normalization values for mouth feature
     :param pucs_norm: Normalization values for pupil feature
     :param moes_norm: Normalization values for mouth over eye feature. 
-    :param 
+    :param pipelined: Run capture, FaceMesh, decision/serial and render on separate threads (see run_pipeline)
+    :param render: Draw and show the annotated frames. If False (headless) nothing is drawn, no window is opened
+        and the loop only stops when running is cleared (Arduino button, SIGINT or SIGTERM)
+    :param profile: Stored RunningStats of the driver. The normalization values are refined online with the
+        features of neutral frames, and inference stops early when they drift more than max_drift from the profile
+    :param max_drift: Allowed drift (RunningStats.drift) of this session from the profile
+    :param min_drift_samples: Neutral frames collected before the drift is checked
+    :param scheduler: Optional AdaptiveScheduler that skips frames and spaces out the classifications while the
+        driver is clearly alert
+    :param decision_config: Decision thresholds (decision.load_config), count_detect_drownsiness overrides its value
+    :return: RunningStats of the neutral frames of this session, True if the profile drifted and
+        the driver must be calibrated again
     '''
     global running, running_inference, alert, detect
 
-    ear_main = 0
-    mar_main = 0
-    puc_main = 0
-    moe_main = 0
-    pitch_main = 0
-    yaw_main = 0
-    roll_main = 0
-    head = 0
-    head_count = 0
-    decay = 0.9 # use decay to smoothen the noise in feature values
-
-    label = None
-
-    input_data = []
-    frame_before_run = 0
-    count_decision = 0 
+    stream = classifier if getattr(classifier, 'streaming', False) else None
+    if stream is not None:
+        stream.reset()
+    state = DrowsinessState(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred_norm, yaw_pred_norm, roll_pred_norm,
+                            get_classification, count_detect_drownsiness=count_detect_drownsiness, stream=stream,
+                            config=decision_config)
+    session = RunningStats()
+    drifted = threading.Event()
+    if scheduler is not None:
+        scheduler.reset()
     cap = cv2.VideoCapture(1)
     width, height = 1280, 720
     cap.set(3, width)
     cap.set(4, height)
-    
 
-    while cap.isOpened() and running:
-
-        success, image = cap.read()
-        if not success:
-            print("Ignoring empty camera frame.")
-            continue
-        ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image = run_face_mp(image, height=height, width=width)
+    def decide(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image, detected, repeated = False, landmarks = None):
+        ''' Update the smoothed features, run the classifier when due and set the alert flag for one frame.
+        :param detected: Whether a face was found in this frame
+        :param repeated: The frame was skipped by the scheduler, the features are those of the last analyzed frame
+            and image is None
+        :param landmarks: Normalized landmarks of the frame for the recorder
+        :return: Frame annotated with the current state
+        '''
+        global running_inference, alert
 
         if running_inference: # Nếu xe đang chạy, chạy inference và ngược lại
-            
-            if ear != -1000:
-                ear = (ear - ears_norm[0])/ears_norm[1]
-                mar = (mar - mars_norm[0])/mars_norm[1]
-                puc = (puc - pucs_norm[0])/pucs_norm[1]
-                moe = (moe - moes_norm[0])/moes_norm[1]
-                pitch_main = pitch_pred - pitch_pred_norm
-                # yaw_main = yaw_pred - yaw_pred_norm
-                # roll_main = roll_pred - roll_pred_norm
-                if ear_main == -1000:
-                    ear_main = ear
-                    mar_main = mar
-                    puc_main = puc
-                    moe_main = moe
-                else:
-                    ear_main = ear_main*decay + (1-decay)*ear
-                    mar_main = mar_main*decay + (1-decay)*mar
-                    puc_main = puc_main*decay + (1-decay)*puc
-                    moe_main = moe_main*decay + (1-decay)*moe
-            else:
-                ear_main = -1000
-                mar_main = -1000    
-                puc_main = -1000
-                moe_main = -1000
-                pitch_main = pitch_main
-                # yaw_main = 0
-                # roll_main = 0
-            if detect:
-                if pitch_main > 0.25 or pitch_main < - 0.2:
-                    head = 1
-                    head_count += 1
-                else:
-                    head = 0
-                    head_count = 0
-            else:
-                if pitch_main > 0.2 or pitch_main < -0.15:
-                    head_count += 1
-                else:
-                    head_count == 0
-
-            if len(input_data) == 20:
-                input_data.pop(0)
-            input_data.append([ear_main, mar_main, puc_main, moe_main])
-
-            frame_before_run += 1
-
-            if frame_before_run >= 15 and len(input_data) == 20:
-                frame_before_run = 0
-                label = get_classification(input_data) # 1 is drowsiness, 0 is normal
-                # print ('got label ', label)
-                if label == 0:
-                    count_decision = 0 # Reset count_decision if predict no drownsiness
-                else:
-                    count_decision += 1
-                print(count_decision)
+            previous_alert = alert
+            with metrics.timer('stage', stage='decision'):
+                alert = state.step(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, detected)
+            if alert != previous_alert:
+                metrics.inc('alert_transitions_total', to='on' if alert else 'off')
+            metrics.set('alert', int(alert))
+            if state.probability is not None:
+                metrics.set('drowsiness_probability', state.probability)
+            if recorder is not None:
+                recorder.write(state, detected, landmarks=landmarks, repeated=repeated)
+            if profile is not None and not repeated and ear != -1000 and not alert and state.label != 1 and state.head == 0:
+                # neutral frame, refine the driver baselines
+                session.update(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred)
+            if state.classified:
+                mark_startup('first_decision')
+                metrics.inc('decisions_total', label=state.label)
+                metrics.set('count_decision', state.count_decision)
+                print(state.count_decision)
+                if profile is not None and session.count >= min_drift_samples:
+                    drift = session.drift(profile)
+                    metrics.set('calibration_drift', drift)
+                    if drift > max_drift:
+                        drifted.set()
+                    else:
+                        state.set_norms(*profile.merged(session).norms())
+            if scheduler is not None:
+                level = scheduler.update(state, detected, classifier.last_scores if state.classified else None)
+                metrics.set('scheduler_level', level)
+
+            if alert:
+                print("CẢNH BÁO CẢNH BÁO, người dùng đang buồn ngủ")
+            if not render or repeated:
+                return image
 
-            cv2.putText(image, "EAR: %.2f" %(ear_main), (int(0.02*width), int(0.07*height)),
+            cv2.putText(image, "EAR: %.2f" %(state.ear_main), (int(0.02*width), int(0.07*height)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            cv2.putText(image, "MAR: %.2f" %(mar_main), (int(0.27*width), int(0.07*height)),
+            cv2.putText(image, "MAR: %.2f" %(state.mar_main), (int(0.27*width), int(0.07*height)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            cv2.putText(image, "PUC: %.2f" %(puc_main), (int(0.52*width), int(0.07*height)),
+            cv2.putText(image, "PUC: %.2f" %(state.puc_main), (int(0.52*width), int(0.07*height)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            cv2.putText(image, "MOE: %.2f" %(moe_main), (int(0.77*width), int(0.07*height)),
+            cv2.putText(image, "MOE: %.2f" %(state.moe_main), (int(0.77*width), int(0.07*height)),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
 
             # Prepare text to display on the screen
-            angle_text_pitch = f"Pitch: {pitch_main:.2f}°"
-            angle_text_yaw = f"Yaw: {yaw_main:.2f}°"
-            angle_text_roll = f"Roll: {roll_main:.2f}°"
+            angle_text_pitch = f"Pitch: {state.pitch_main:.2f}°"
+            angle_text_yaw = f"Yaw: {state.yaw_main:.2f}°"
+            angle_text_roll = f"Roll: {state.roll_main:.2f}°"
 
             # Display the angle values on the image
             cv2.putText(image, angle_text_pitch, (25, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
             cv2.putText(image, angle_text_yaw, (25, 180), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
             cv2.putText(image, angle_text_roll, (25, 210), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
+            if state.probability is not None:
+                cv2.putText(image, "P(drowsy): %.2f" % state.probability, (25, 240), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
             
-            if label is not None:
-                if label == 0:
+            if state.label is not None:
+                if state.label == 0:
                     color = (0, 255, 0)
                 else:
                     color = (0, 0, 255)
-                cv2.putText(image, "%s" %(states[label]), (int(0.02*image.shape[1]), int(0.15*image.shape[0])),
+                cv2.putText(image, "%s" %(states[state.label]), (int(0.02*image.shape[1]), int(0.15*image.shape[0])),
                             cv2.FONT_HERSHEY_SIMPLEX, 1.5, color, 3)
-            
-            if count_decision >= count_detect_drownsiness or (head == 1 and head_count >=20): # Turn Alert
-                alert = True
-                print("CẢNH BÁO CẢNH BÁO, người dùng đang buồn ngủ")
-            else:
-                alert = False
 
         else:
-            image.fill(0)
-            count_decision = 0
-            head_count = 0
+            if render and not repeated:
+                image.fill(0)
+            state.pause()
             alert = False
-        cv2.imshow('MediaPipe FaceMesh', image)
-        if cv2.waitKey(5) & 0xFF == ord("q"):
-            running = False
-    running = False
+            if recorder is not None:
+                # always-on recorder: paused frames too
+                recorder.write(state, detected, landmarks=landmarks, repeated=repeated, mode='paused')
+        return image
+
+    if pipelined:
+        run_pipeline(cap, height, width, decide, render=render, stop_event=drifted, scheduler=scheduler)
+    else:
+        last_features = None
+        last_detected = False
+        while cap.isOpened() and running and not drifted.is_set():
+
+            frame_start = time.perf_counter()
+            if last_features is not None and scheduler is not None and not scheduler.should_analyze():
+                # skipped frame: grab without decoding and repeat the last features
+                cap.grab()
+                metrics.inc('skipped_frames_total')
+                decide(*last_features, None, last_detected, repeated=True)
+                continue
+            if face_pool is not None:
+                outputs = run_face_pool(cap, height, width, render=render)
+            else:
+                with metrics.timer('stage', stage='capture'):
+                    success, image = cap.read()
+                if not success:
+                    metrics.inc('empty_frames_total')
+                    print("Ignoring empty camera frame.")
+                    continue
+                outputs = [(run_face_mp(image, height=height, width=width, render=render), detect, face_landmarks)]
+            for (ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image), detected, landmarks in outputs:
+                last_features = (ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred)
+                last_detected = detected
+                image = decide(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image, detected, landmarks=landmarks)
+                if render:
+                    with metrics.timer('stage', stage='render'):
+                        cv2.imshow('MediaPipe FaceMesh', image)
+                        key = cv2.waitKey(5)
+                    if key & 0xFF == ord("q"):
+                        running = False
+            metrics.observe('frame', time.perf_counter() - frame_start)
+    if not drifted.is_set():
+        running = False
     alert = False
-    cv2.destroyAllWindows()
+    if render:
+        cv2.destroyAllWindows()
     cap.release()
+    return session, drifted.is_set()
+
+def run_pipeline(cap, height, width, decide, render = True, queue_size = 1, stats_interval = 10, stop_event = None,
+                 scheduler = None):
+    ''' Run capture -> FaceMesh -> decision/serial (-> render) as a staged pipeline.
+    Each stage runs on its own thread and stages are joined by bounded latest-frame-wins queues,
+    so a slow stage drops old frames instead of delaying the alert.
+    :param cap: Opened cv2.VideoCapture
+    :param decide: Per-frame decision function from infer()
+    :param render: If True the main thread shows the annotated frames, otherwise (headless) nothing is drawn
+        and the decision stage is the last stage
+    :param queue_size: Capacity of the queues between stages
+    :param stats_interval: Seconds between printing the per-stage queue depth and drop counts
+    :param stop_event: Optional threading.Event that also stops the pipeline when set
+    :param scheduler: Optional AdaptiveScheduler, skipped frames are only grabbed and the decision stage repeats
+        the last analyzed features for them
+    '''
+    global running
 
+    center_x, center_y = width // 2, height // 2
 
-# Luồng liên tục nhận dữ liệu từ Arduino
-def read_arduino_data():
-    global arduino
-
-    while True:
-        try:
-            arduino = serial.Serial(port='COM9', baudrate=19200, timeout=1)
-            break
-        except serial.SerialException:
-            print("Lỗi kết nối với Arduino. Đang thử lại...")
-            time.sleep(1)  # Chờ ngắn trước khi thử lại để tránh spam lỗi
+    def capture():
+        if not (cap.isOpened() and running) or (stop_event is not None and stop_event.is_set()):
+            pipeline.stop()
+            return None
+        if scheduler is not None and not scheduler.should_analyze():
+            cap.grab()
+            metrics.inc('skipped_frames_total')
+            return time.perf_counter(), None
+        with metrics.timer('stage', stage='capture'):
+            success, image = cap.read()
+        if not success:
+            metrics.inc('empty_frames_total')
+            print("Ignoring empty camera frame.")
+            return None
+        return time.perf_counter(), image
+
+    def face_stage(item):
+        captured, image = item
+        if image is None:
+            return captured, None, None, None, None
+        result = run_face_mp(image, height=height, width=width, serial_io=False, render=render)
+        return captured, result, nose_position, detect, face_landmarks
+
+    last = [] # features and detection flag of the last analyzed frame, repeated for skipped frames
+
+    def decision_stage(item):
+        captured, result, nose, detected, landmarks = item
+        if result is None:
+            if last:
+                decide(*last[0], None, last[1], repeated=True)
+            return None
+        ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image = result
+        last[:] = [(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred), detected]
+        image = decide(ear, mar, puc, moe, pitch_pred, yaw_pred, roll_pred, image, detected, landmarks=landmarks)
+        if nose is not None:
+            handle_arduino(nose[0] - center_x, nose[1] - center_y, captured)
+        else:
+            handle_arduino(None, None, captured)
+        # capture -> decision latency, the time an alert lags behind the camera
+        metrics.observe('frame', time.perf_counter() - captured)
+        return image
+
+    pipeline = Pipeline(maxsize=queue_size)
+    pipeline.add_stage('capture', capture)
+    pipeline.add_stage('facemesh', face_stage)
+    pipeline.add_stage('decision', decision_stage, sink=not render)
+    for stage in pipeline.stages[1:]:
+        metrics.gauge_fn('pipeline_queue_depth', stage.inbox.qsize, stage=stage.name)
+        metrics.counter_fn('pipeline_dropped_frames_total', lambda inbox=stage.inbox: inbox.dropped, stage=stage.name)
+    pipeline.start()
+
+    last_stats = time.time()
+    while pipeline.running and running:
+        if render:
+            try:
+                image = pipeline.output.get(timeout=0.1)
+            except queue.Empty:
+                image = None
+            if image is not None:
+                with metrics.timer('stage', stage='render'):
+                    cv2.imshow('MediaPipe FaceMesh', image)
+                    key = cv2.waitKey(5)
+                if key & 0xFF == ord("q"):
+                    running = False
+        else:
+            time.sleep(0.1)
+        if time.time() - last_stats >= stats_interval:
+            last_stats = time.time()
+            print(pipeline.stats())
+    pipeline.stop()
+    pipeline.join()
+    print(pipeline.stats())
+    if pipeline.error is not None:
+        raise pipeline.error
 
 
 if __name__ == "__main__":
     warnings.filterwarnings("ignore", category=UserWarning)
 
-    right_eye = [[33, 133], [160, 144], [159, 145], [158, 153]] # right eye landmark positions
-    left_eye = [[263, 362], [387, 373], [386, 374], [385, 380]] # left eye landmark positions
-    mouth = [[61, 291], [39, 181], [0, 17], [269, 405]] # mouth landmark coordinates
+    parser = argparse.ArgumentParser(description='Drowsiness detection')
+    parser.add_argument('--pipelined', action='store_true', help='run capture, FaceMesh, decision and render on separate threads')
+    parser.add_argument('--headless', '--no-render', dest='headless', action='store_true',
+                        help='no drawing and no window (for units without display), stop with SIGINT/SIGTERM')
+    parser.add_argument('--port', default='COM9', help='Arduino serial port (or a pyserial URL such as loop://)')
+    parser.add_argument('--serial-protocol', choices=['binary', 'text'], default='binary',
+                        help='binary for sketch_nov14a.ino, text for Arduinos still flashed with the "alert,x,y" sketch')
+    parser.add_argument('--serial-rate', type=float, default=20.0, help='servo commands sent per second at most')
+    parser.add_argument('--torch-threads', type=int,
+                        help='torch intra-op threads for the LSTM classifier (default 1, or the count --lstm-variant was tuned with)')
+    parser.add_argument('--lstm-variant', help="classifier variant built by quantize_models.py: 'auto' for the fastest "
+                                               "one that passed the accuracy gate, or frozen / int8 / original")
+    parser.add_argument('--lstm', default='clf_lstm',
+                        help='drowsiness classifier: one of %s or a model path' % ', '.join(LSTM_MODELS))
+    parser.add_argument('--streaming', action='store_true',
+                        help='score clf_lstm incrementally: one sub-window per frame, drowsiness probability on every frame')
+    parser.add_argument('--warmup', action='store_true', help='run a dummy forward pass through every model while loading')
+    parser.add_argument('--roi', action='store_true', help='run FaceMesh on a downsized crop around the last detected face')
+    parser.add_argument('--roi-size', type=int, default=256, help='side (pixels) the ROI crop is downsized to')
+    parser.add_argument('--face-workers', type=int, default=0,
+                        help='run FaceMesh on N worker processes fed through shared memory (0: in this process)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='analyze fewer frames and classify less often while the driver is clearly alert')
+    parser.add_argument('--record', help='record the decision state of every frame to this ring file (see recorder.py)')
+    parser.add_argument('--record-hours', type=float, default=8, help='hours (at 30 fps) kept in the recording')
+    parser.add_argument('--record-landmarks', action='store_true', help='also record the FaceMesh landmarks (3.7 KB per frame)')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-log', help='append a JSON metrics snapshot to this file every --metrics-interval seconds')
+    parser.add_argument('--metrics-interval', type=float, default=10.0)
+    parser.add_argument('--driver', default='default', help='driver profile of the calibration store')
+    parser.add_argument('--calibration-store', default='calibration.json', help='JSON file with the per-driver calibration')
+    parser.add_argument('--calibration-max-age', type=float, default=30, help='days after which a stored calibration is redone')
+    parser.add_argument('--max-drift', type=float, default=3.0,
+                        help='recalibrate when the online baselines drift more than this many stds from the stored profile')
+    parser.add_argument('--recalibrate', action='store_true', help='ignore the stored calibration of the driver')
+    parser.add_argument('--decision-config', help='JSON file overriding the decision thresholds (see decision.DEFAULT_CONFIG)')
+    args = parser.parse_args()
+    if args.face_workers and (args.pipelined or args.roi):
+        parser.error('--face-workers cannot be combined with --pipelined or --roi')
+    decision_config = load_config(args.decision_config)
+
+    # FaceMesh, head pose and classifier load concurrently while the serial link and the calibration store are opened
+    registry = ModelRegistry(args.lstm, torch_threads=args.torch_threads, warmup=args.warmup, streaming=args.streaming,
+                             variant=args.lstm_variant)
+    registry.start(['head_pose', 'classifier'] if args.face_workers else None)
+
+    metrics.gauge_fn('rss_mb', get_memory_usage)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.metrics_log:
+        metrics.start_log(args.metrics_log, args.metrics_interval)
+
     states = ['normal', 'drowsy']
+    scheduler = AdaptiveScheduler() if args.adaptive else None
+    if args.roi:
+        # separate full-frame FaceMesh, the registry one only sees crops
+        roi_tracker = ROITracker(load_face_mesh(), max_side=args.roi_size)
+        metrics.counter_fn('roi_fallbacks_total', lambda: roi_tracker.fallbacks)
+    if args.record:
+        recorder = Recorder(args.record, capacity=int(args.record_hours * 3600 * 30), landmarks=args.record_landmarks)
+    if args.face_workers:
+        # the workers load their own FaceMesh graphs, started on the first camera frame
+        face_pool = FaceMeshPool(workers=args.face_workers)
+        metrics.counter_fn('face_pool_dropped_total', lambda: face_pool.dropped)
 
     running = True  
     running_inference = True
     alert = False
     stop_thread = False
 
-    servo_delta_x = 0
-    servo_delta_y = 0
-    current_servo_x = 90
-    current_servo_y = 90
+    def shutdown(signum, frame):
+        # Ctrl+C / systemd stop: leave the frame loop and the main loop instead of waiting for "q"
+        global running, stop_thread
+        running = False
+        stop_thread = True
+    if args.headless:
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
 
-    # Declaring FaceMesh model
-    mp_face_mesh = mp.solutions.face_mesh
-    face_mesh = mp_face_mesh.FaceMesh(
-        min_detection_confidence=0.3, min_tracking_confidence=0.8)
-    mp_drawing = mp.solutions.drawing_utils 
-    drawing_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+    # camera frames are 1280x720 (infer / calibrate)
+    servo_tracker = ServoTracker(1280, 720)
+
+    # Luồng liên tục nhận dữ liệu từ Arduino, reconnects in the background
+    arduino = SerialLink(args.port, baudrate=19200, max_rate=args.serial_rate, protocol=args.serial_protocol).start()
+    metrics.counter_fn('serial_bytes_sent_total', lambda: arduino.bytes_sent)
+    metrics.counter_fn('serial_commands_sent_total', lambda: arduino.commands_sent)
+    metrics.counter_fn('serial_commands_coalesced_total', lambda: arduino.commands_coalesced)
 
-    model_head_pose = pickle.load(open('./model.pkl', 'rb'))
+    store = CalibrationStore(args.calibration_store, max_age=args.calibration_max_age * 24 * 3600)
+    recalibrate = args.recalibrate
 
-    model_lstm_path = 'models\clf_lstm_jit6.pth'
-    model = torch.jit.load(model_lstm_path)
-    model.eval()
-    read_arduino_data()
+    # Declaring FaceMesh model
+    face_mesh = None if args.face_workers else registry.get('face_mesh')
+    if not args.headless:
+        import mediapipe as mp
+        mp_face_mesh = mp.solutions.face_mesh
+        mp_drawing = mp.solutions.drawing_utils 
+        drawing_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+    # NumPy-only export of model.pkl (python pose_regressor.py)
+    model_head_pose = registry.get('head_pose')
+    classifier = registry.get('classifier')
+    mark_startup('models_loaded')
+    print('Model load times: %s' % {name: round(seconds, 2) for name, seconds in registry.load_times.items()})
+    if args.lstm_variant and not args.streaming:
+        variant = select_variant(args.lstm, args.lstm_variant)
+        print('Classifier variant: %s' % ('%(variant)s, %(threads)d threads, p50 %(p50_ms).3f ms' % variant
+                                           if variant else 'original (no passing variant in the manifest)'))
 
     try:
-        while True:
+        while not stop_thread:
             if running:
-                print('Starting calibration. Please be in neutral state')
-                ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred, yaw_pred, roll_pred = calibrate()
+                profile = None if recalibrate else store.load(args.driver)
+                if profile is not None and not profile.valid():
+                    print('Ignoring the unusable stored calibration of driver %s' % args.driver)
+                    profile = None
+                if profile is None:
+                    print('Starting calibration. Please be in neutral state')
+                    norms, samples = calibrate(render=not args.headless)
+                    if stop_thread:
+                        break
+                    if norms is None:
+                        # "q" during calibration: pause like during inference, nothing is stored
+                        print('Calibration stopped after %d frames with a face, not saved' % samples)
+                        running = False
+                        continue
+                    profile = RunningStats.from_norms(norms, count=samples)
+                    if not profile.valid():
+                        print('Calibration on %d frames has no usable spread, recalibrating' % samples)
+                        continue
+                    store.save(args.driver, profile)
+                    recalibrate = False
+                else:
+                    print('Using the stored calibration of driver %s' % args.driver)
+                ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred, yaw_pred, roll_pred = profile.norms()
                 print(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred, yaw_pred, roll_pred)
                 print('Starting main application')
-                infer(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred, yaw_pred, roll_pred)
+                session, recalibrate = infer(ears_norm, mars_norm, pucs_norm, moes_norm, pitch_pred, yaw_pred, roll_pred,
+                                             pipelined=args.pipelined, render=not args.headless,
+                                             profile=profile, max_drift=args.max_drift, scheduler=scheduler,
+                                             decision_config=decision_config)
+                if recalibrate:
+                    print('Calibration of driver %s drifted, recalibrating' % args.driver)
+                elif session.count and profile.valid():
+                    store.save(args.driver, profile.merged(session))
             else:
-                if arduino.in_waiting > 0:
-                    data = arduino.readline().decode('utf-8').strip()  # Đọc và giải mã dòng dữ liệu
-                    if data in ['01', '10']:
-                        flag1 = int(data[0])
-                        flag2 = int(data[1])
-                        # Kiểm tra giá trị và thay đổi các cờ
-                        if flag2 == 1:
-                            running_inference = not running_inference
-                        if flag1 == 1:
-                            running = not running
-                            if running:
-                                running_inference = True
-                                alert = False
-                time.sleep(1)
+                event = arduino.wait_event(timeout=1)
+                if event is not None:
+                    handle_event(*event)
     except KeyboardInterrupt:
         running = False
-        arduino.close()
-        print("Dừng chương trình...")      
+    if face_pool is not None:
+        face_pool.close()
+    if recorder is not None:
+        recorder.close()
+    arduino.close()
+    print("Dừng chương trình...")      
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+PREFIX = 'drowsiness_'
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, v) for k, v in items) + '}'
+
+
+class _Timer:
+    __slots__ = ('metrics', 'key', 'start')
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._observe(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    ''' Hot-path counters, gauges and stage timers.
+    Recording is an O(1) append under a lock, percentiles are only computed when the metrics are read
+    (HTTP scrape or rolling log), so the instrumentation can stay on in production.
+    '''
+    def __init__(self, window=1000):
+        '''
+        :param window: Number of recent durations kept per timer for the percentiles
+        '''
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._counter_fns = {}
+        self._timings = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self._gauges[_key(name, labels)] = value
+
+    def gauge_fn(self, name, fn, **labels):
+        ''' Register a gauge evaluated when the metrics are read, e.g. RSS or queue depth '''
+        self._gauge_fns[_key(name, labels)] = fn
+
+    def counter_fn(self, name, fn, **labels):
+        ''' Register a counter read from an ever-increasing attribute when the metrics are read, e.g. dropped
+        frames. Name it with a _total suffix
+        '''
+        self._counter_fns[_key(name, labels)] = fn
+
+    def timer(self, name, **labels):
+        ''' Context manager measuring the duration of a stage: `with metrics.timer('facemesh'): ...` '''
+        return _Timer(self, _key(name, labels))
+
+    def observe(self, name, seconds, **labels):
+        self._observe(_key(name, labels), seconds)
+
+    def _observe(self, key, seconds):
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = [deque(maxlen=self.window), 0, 0.0]
+            timing[0].append(seconds)
+            timing[1] += 1
+            timing[2] += seconds
+
+    def _collect(self):
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {key: (np.array(values), count, total) for key, (values, count, total) in self._timings.items()}
+        gauges = dict(self._gauges)
+        for values, fns in ((counters, self._counter_fns), (gauges, self._gauge_fns)):
+            for key, fn in list(fns.items()):
+                try:
+                    values[key] = fn()
+                except Exception:
+                    continue
+        return counters, gauges, timings
+
+    def snapshot(self):
+        ''' Current values as a plain dict (percentiles in milliseconds) '''
+        counters, gauges, timings = self._collect()
+
+        def name(key):
+            return key[0] + _format_labels(key[1])
+
+        snapshot = {'time': time.time(), 'counters': {}, 'gauges': {}, 'timings': {}}
+        for key, value in counters.items():
+            snapshot['counters'][name(key)] = value
+        for key, value in gauges.items():
+            snapshot['gauges'][name(key)] = float(value)
+        for key, (values, count, total) in timings.items():
+            p50, p95, p99 = (float(v) for v in np.percentile(values, [50, 95, 99]) * 1000)
+            snapshot['timings'][name(key)] = {'count': count, 'mean_ms': total / count * 1000,
+                                              'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+        return snapshot
+
+    def prometheus(self):
+        ''' Metrics in the Prometheus text exposition format '''
+        counters, gauges, timings = self._collect()
+
+        lines = []
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                    typed.add(name)
+                lines.append('%s%s%s %s' % (PREFIX, name, _format_labels(labels), float(value)))
+        typed = set()
+        for (name, labels), (values, count, total) in sorted(timings.items()):
+            if name not in typed:
+                lines.append('# TYPE %s%s_seconds summary' % (PREFIX, name))
+                typed.add(name)
+            for q, v in zip(('0.5', '0.95', '0.99'), np.percentile(values, [50, 95, 99])):
+                lines.append('%s%s_seconds%s %.9f' % (PREFIX, name, _format_labels(labels, [('quantile', q)]), v))
+            lines.append('%s%s_seconds_count%s %d' % (PREFIX, name, _format_labels(labels), count))
+            lines.append('%s%s_seconds_sum%s %.9f' % (PREFIX, name, _format_labels(labels), total))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        ''' Expose /metrics over HTTP on a daemon thread
+        :return: The HTTP server (call shutdown() to stop it)
+        '''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+    def start_log(self, path, interval=10.0, max_lines=8640):
+        ''' Append a JSON snapshot to `path` every `interval` seconds on a daemon thread.
+        The file is rolled over to `path`.1 after max_lines snapshots.
+        '''
+        def loop():
+            lines = 0
+            while True:
+                time.sleep(interval)
+                if lines >= max_lines:
+                    os.replace(path, path + '.1')
+                    lines = 0
+                with open(path, 'a') as f:
+                    f.write(json.dumps(self.snapshot(), default=float) + '\n')
+                lines += 1
+
+        thread = threading.Thread(target=loop, name='metrics-log', daemon=True)
+        thread.start()
+        return thread
+
+
+metrics = Metrics()
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, 'models')
+VARIANT_DIR = os.path.join(MODEL_DIR, 'variants') # int8 / frozen classifiers and manifest.json (python quantize_models.py)
+
+# Selectable drowsiness classifiers: name -> (file in models/, classifier kind)
+LSTM_MODELS = {
+    'clf_lstm': ('clf_lstm_jit6.pth', 'lstm'),       # 6 sub-windows of 5 frames, 5 of 6 votes
+    'best': ('best_model_jit.pth', 'window'),        # HybridCNNLSTM, one score per 20-frame window
+    'latest': ('latest_model_jit.pth', 'window'),
+}
+
+def resolve_path(path, base_dir=BASE_DIR):
+    ''' Make a model path portable: accepts "models\\x.pth" or "models/x.pth", relative to the working
+    directory or, if it does not exist there, to the repository directory
+    '''
+    path = os.path.normpath(path.replace('\\', '/'))
+    if not os.path.isabs(path) and not os.path.exists(path):
+        path = os.path.join(base_dir, path)
+    return path
+
+def lstm_model_path(name):
+    ''' Path of a registered classifier (name of LSTM_MODELS) or of any model file '''
+    if name in LSTM_MODELS:
+        return os.path.join(MODEL_DIR, LSTM_MODELS[name][0])
+    return resolve_path(name)
+
+def select_variant(name, variant='auto', manifest_path=None):
+    ''' Manifest entry of a classifier variant that passed the accuracy gate of quantize_models.py
+    :param variant: Variant name ('frozen', 'int8', 'original') or 'auto' for the fastest one
+    :return: Dict with variant, path (None for the original model), threads, p50_ms, or None if there is none
+    '''
+    manifest_path = manifest_path or os.path.join(VARIANT_DIR, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        entry = json.load(f)['models'].get(name)
+    if entry is None:
+        return None
+    if variant == 'auto':
+        return entry['selected']
+    passed = [v for v in entry['variants'] if v['variant'] == variant and v['passed']]
+    return min(passed, key=lambda v: v['p50_ms']) if passed else None
+
+def load_classifier(name, num_threads=None, streaming=False, variant=None):
+    ''' Load a drowsiness classifier by registry name or path
+    :param streaming: Score every frame incrementally (StreamingClassifier), only for the clf_lstm sub-window model
+    :param variant: None for the float32 model, 'auto' for the fastest variant that passed the accuracy gate or
+        a variant name (see select_variant). Without a usable variant the float32 model is loaded.
+        num_threads=None then uses the thread count the variant was timed with, or 1 without a variant
+    :return: LSTMClassifier for the clf_lstm model, WindowClassifier for the HybridCNNLSTM models
+    '''
+    from classifier import LSTMClassifier, StreamingClassifier, WindowClassifier
+
+    selected = select_variant(name, variant) if variant and not streaming else None
+    if selected is not None:
+        if num_threads is None:
+            num_threads = selected['threads']
+        if selected['path'] is not None:
+            import torch
+            module = torch.jit.load(os.path.join(VARIANT_DIR, selected['path']), map_location='cpu')
+            if LSTM_MODELS[name][1] == 'lstm':
+                return LSTMClassifier(module, num_threads=num_threads, batch_model=module)
+            return WindowClassifier(module, num_threads=num_threads)
+
+    if num_threads is None:
+        num_threads = 1 # no tuned count (no variant, or no manifest in this checkout)
+    kind = LSTM_MODELS[name][1] if name in LSTM_MODELS else None
+    if kind is None:
+        import torch
+        names = dict(torch.jit.load(lstm_model_path(name), map_location='cpu').named_parameters())
+        kind = 'lstm' if 'pre_fc.weight' in names else 'window'
+    if streaming and kind != 'lstm':
+        raise ValueError('streaming classification needs a sub-window model such as clf_lstm, %s scores whole windows' % name)
+    cls = WindowClassifier if kind == 'window' else StreamingClassifier if streaming else LSTMClassifier
+    return cls.load(lstm_model_path(name), num_threads=num_threads)
+
+def load_head_pose(path='head_pose.npz'):
+    ''' NumPy head-pose model, exported from model.pkl on the fly if the .npz is missing '''
+    from pose_regressor import HeadPoseRegressor
+
+    path = resolve_path(path)
+    if os.path.exists(path):
+        return HeadPoseRegressor.load(path)
+    import pickle
+    with open(resolve_path('model.pkl'), 'rb') as f:
+        return HeadPoseRegressor.from_sklearn(pickle.load(f))
+
+def load_face_mesh(min_detection_confidence=0.3, min_tracking_confidence=0.8):
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(min_detection_confidence=min_detection_confidence,
+                                           min_tracking_confidence=min_tracking_confidence)
+
+def warmup_face_mesh(face_mesh, width=1280, height=720):
+    face_mesh.process(np.zeros((height, width, 3), dtype=np.uint8))
+
+def warmup_head_pose(model):
+    model.predict(np.zeros((1, 14)))
+
+def warmup_classifier(classifier):
+    classifier.classify(np.zeros((20, 4), dtype=np.float32))
+
+
+class ModelRegistry:
+    ''' Loads the models on first use, or all at once in background threads with start().
+    The heavy imports (mediapipe, torch) only happen inside the loaders, so the process can open
+    the camera and the serial port while the models are still loading.
+    '''
+    def __init__(self, lstm='clf_lstm', head_pose='head_pose.npz', torch_threads=1, warmup=False, streaming=False,
+                 variant=None):
+        '''
+        :param lstm: Classifier name of LSTM_MODELS or model path
+        :param head_pose: Path of the NumPy head-pose model
+        :param torch_threads: torch intra-op threads of the classifier
+        :param warmup: Run one dummy forward pass after loading, so the first frame does not pay for lazy initialisation
+        :param streaming: Load the classifier as StreamingClassifier
+        :param variant: Classifier variant of quantize_models.py (see load_classifier)
+        '''
+        self.loaders = {
+            'face_mesh': (load_face_mesh, warmup_face_mesh),
+            'head_pose': (lambda: load_head_pose(head_pose), warmup_head_pose),
+            'classifier': (lambda: load_classifier(lstm, num_threads=torch_threads, streaming=streaming,
+                                                          variant=variant), warmup_classifier),
+        }
+        self.warmup = warmup
+        self.load_times = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=len(self.loaders), thread_name_prefix='model-load')
+
+    def _load(self, name):
+        start = time.perf_counter()
+        load, warmup = self.loaders[name]
+        model = load()
+        if self.warmup:
+            warmup(model)
+        self.load_times[name] = time.perf_counter() - start
+        return model
+
+    def _future(self, name):
+        with self._lock:
+            if name not in self._futures:
+                self._futures[name] = self._pool.submit(self._load, name)
+            return self._futures[name]
+
+    def start(self, names=None):
+        ''' Start loading the models (all by default) concurrently, returns immediately '''
+        for name in names or self.loaders:
+            self._future(name)
+        return self
+
+    def get(self, name, timeout=None):
+        ''' Model by name, loading it now if start() was not called. Load errors are raised here '''
+        return self._future(name).result(timeout)
+
+    def ready(self, name):
+        return name in self._futures and self._futures[name].done()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
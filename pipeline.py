@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+
+class LatestQueue:
+    ''' Bounded queue with a latest-item-wins policy.
+    When the queue is full the oldest item is discarded so a slow consumer always sees the newest frame.
+    '''
+    def __init__(self, maxsize=1):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._lock:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class Stage(threading.Thread):
+    ''' One pipeline stage running on its own thread.
+    A stage without inbox is a source: fn() is called repeatedly and every non-None result is forwarded.
+    Otherwise fn(item) is called for each item of the inbox and non-None results go to the outbox.
+    '''
+    def __init__(self, name, fn, inbox, outbox, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.processed = 0
+        self.busy_time = 0.0
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.inbox is None:
+                    item = None
+                else:
+                    try:
+                        item = self.inbox.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                start = time.perf_counter()
+                result = self.fn() if self.inbox is None else self.fn(item)
+                self.busy_time += time.perf_counter() - start
+                self.processed += 1
+                if result is not None and self.outbox is not None:
+                    self.outbox.put(result)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+
+
+class Pipeline:
+    ''' Linear chain of stages joined by bounded LatestQueues.
+    Alert latency tracks the slowest stage instead of the sum of all stages, frames that a stage
+    could not keep up with are dropped (and counted) at its inbox.
+    '''
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.stop_event = threading.Event()
+        self.stages = []
+        self.output = None
+
+    def add_stage(self, name, fn, sink=False):
+        ''' Append a stage to the chain
+        :param name: Stage name used in stats()
+        :param fn: Stage function. The first stage is a source and takes no argument
+        :param sink: If True the stage results are discarded instead of queued for the next stage
+        '''
+        inbox = self.output if self.stages else None
+        self.output = None if sink else LatestQueue(self.maxsize)
+        self.stages.append(Stage(name, fn, inbox, self.output, self.stop_event))
+        return self
+
+    @property
+    def running(self):
+        return not self.stop_event.is_set()
+
+    @property
+    def error(self):
+        for stage in self.stages:
+            if stage.error is not None:
+                return stage.error
+        return None
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=2):
+        for stage in self.stages:
+            if stage is not threading.current_thread():
+                stage.join(timeout)
+
+    def stats(self):
+        ''' Per-stage counters
+        :return: Dict stage name -> processed items, inbox depth, inbox drops and busy time in seconds
+        '''
+        stats = {}
+        for stage in self.stages:
+            stats[stage.name] = {
+                'processed': stage.processed,
+                'queue_depth': stage.inbox.qsize() if stage.inbox is not None else 0,
+                'dropped': stage.inbox.dropped if stage.inbox is not None else 0,
+                'busy_time': round(stage.busy_time, 3),
+            }
+        return stats
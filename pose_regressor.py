@@ -0,0 +1,144 @@
+import argparse
+import pickle
+import sys
+import numpy as np
+
+# FaceMesh landmarks used by the head-pose model, in the order they appear in the 468 landmarks:
+# nose, forehead, left eye, mouth left, chin, right eye, mouth right
+POSE_LANDMARKS = [1, 10, 33, 61, 199, 263, 291]
+
+def pose_features(landmarks):
+    ''' Gather the 14 head-pose inputs [nose_x, nose_y, ..., mouth_right_y] from FaceMesh landmarks
+    :param landmarks: Landmark array of shape (468, 2) or (N, 468, 2)
+    :return: Array of shape (14,) or (N, 14)
+    '''
+    landmarks = np.asarray(landmarks, dtype=np.float64)[..., POSE_LANDMARKS, :2]
+    return landmarks.reshape(landmarks.shape[:-2] + (14,))
+
+def normalize_poses(poses_array):
+    ''' Center the pose points around the nose and scale them by the left eye -> mouth right distance, per axis
+    :param poses_array: Array of shape (14,) or (N, 14) ordered as ['nose_x', 'nose_y', ..., 'mouth_right_y']
+    :return: Normalized array of the same shape
+    '''
+    poses = np.asarray(poses_array, dtype=np.float64)
+    points = poses.reshape(poses.shape[:-1] + (7, 2))
+    centered = points - points[..., :1, :]
+    scale = points[..., 6:7, :] - points[..., 2:3, :]
+    return (centered / scale).reshape(poses.shape)
+
+
+class HeadPoseRegressor:
+    ''' NumPy-only evaluator of the pickled MultiOutputRegressor(SVR(kernel='rbf')) head-pose model.
+    The three SVRs are folded into one set of support vectors with a (M, 3) coefficient matrix, so
+    pitch, yaw and roll for a batch of frames come from a single kernel evaluation.
+    '''
+    def __init__(self, support_vectors, gammas, coef, intercept):
+        self.support_vectors = np.ascontiguousarray(support_vectors, dtype=np.float64)
+        self.gammas = np.asarray(gammas, dtype=np.float64)
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self._sv_norms = (self.support_vectors ** 2).sum(axis=1)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        ''' Export a fitted MultiOutputRegressor of RBF SVRs
+        :param model: Unpickled model.pkl
+        '''
+        estimators = getattr(model, 'estimators_', [model])
+        for estimator in estimators:
+            if getattr(estimator, 'kernel', None) != 'rbf':
+                raise ValueError('Only RBF SVR estimators can be exported, got %r' % (estimator,))
+        gammas = [float(estimator._gamma) for estimator in estimators]
+
+        vectors, columns, coefs, rows_gamma = [], [], [], []
+        for output, estimator in enumerate(estimators):
+            vectors.append(estimator.support_vectors_)
+            coefs.append(estimator.dual_coef_.ravel())
+            columns.append(np.full(len(estimator.dual_coef_.ravel()), output))
+            rows_gamma.append(np.full(len(estimator.dual_coef_.ravel()), gammas[output]))
+        vectors = np.concatenate(vectors)
+        columns = np.concatenate(columns)
+        coefs = np.concatenate(coefs)
+        rows_gamma = np.concatenate(rows_gamma)
+
+        # The estimators were fitted on the same rows, merge shared support vectors with the same gamma
+        keys = np.concatenate([vectors, rows_gamma[:, None]], axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        coef = np.zeros((len(unique), len(estimators)))
+        np.add.at(coef, (inverse.ravel(), columns), coefs)
+        intercept = np.array([float(np.ravel(estimator.intercept_)[0]) for estimator in estimators])
+        return cls(unique[:, :-1], unique[:, -1], coef, intercept)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['support_vectors'], data['gammas'], data['coef'], data['intercept'])
+
+    def save(self, path):
+        np.savez(path, support_vectors=self.support_vectors, gammas=self.gammas, coef=self.coef, intercept=self.intercept)
+
+    def predict(self, features):
+        ''' Same output as model.predict
+        :param features: Normalized features of shape (14,) or (N, 14)
+        :return: Array of shape (N, 3) with pitch, yaw, roll
+        '''
+        features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        if len(features) == 1:
+            sq_dist = ((self.support_vectors - features) ** 2).sum(axis=1)[None, :]
+        else:
+            sq_dist = (features ** 2).sum(axis=1)[:, None] + self._sv_norms[None, :] - 2 * features @ self.support_vectors.T
+            np.maximum(sq_dist, 0, out=sq_dist)
+        return np.exp(-self.gammas * sq_dist) @ self.coef + self.intercept
+
+    def predict_pose(self, poses_array):
+        ''' Normalize raw pose features and predict
+        :param poses_array: Raw features of shape (14,) or (N, 14), see pose_features
+        :return: Array of shape (N, 3) with pitch, yaw, roll
+        '''
+        return self.predict(normalize_poses(poses_array))
+
+
+def load_recorded_features(path):
+    ''' Load recorded inputs for the equivalence check
+    :param path: .npy file with landmarks (N, 468, 2) or raw pose features (N, 14)
+    :return: Raw pose features of shape (N, 14)
+    '''
+    data = np.load(path)
+    if data.ndim == 3:
+        return pose_features(data)
+    return data.reshape(-1, 14)
+
+def verify(model, regressor, features, tol=1e-6):
+    ''' Compare the exported regressor with model.predict
+    :param features: Normalized features of shape (N, 14)
+    :return: Maximum absolute difference, and whether it is below tol
+    '''
+    expected = model.predict(features)
+    actual = regressor.predict(features)
+    max_diff = float(np.abs(expected - actual).max())
+    return max_diff, max_diff <= tol
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the pickled head-pose model to a NumPy-only evaluator')
+    parser.add_argument('--model', default='./model.pkl', help='pickled sklearn model')
+    parser.add_argument('--output', default='./head_pose.npz', help='exported parameters')
+    parser.add_argument('--landmarks', action='append', default=[],
+                        help='recorded landmarks (N, 468, 2) or pose features (N, 14) .npy used for the equivalence check')
+    parser.add_argument('--tol', type=float, default=1e-6, help='maximum allowed difference to model.predict')
+    args = parser.parse_args()
+
+    model = pickle.load(open(args.model, 'rb'))
+    regressor = HeadPoseRegressor.from_sklearn(model)
+    regressor.save(args.output)
+    print('Exported %d support vectors to %s' % (len(regressor.support_vectors), args.output))
+
+    # Equivalence check on recorded data, or on the training rows kept as support vectors
+    if args.landmarks:
+        features = normalize_poses(np.concatenate([load_recorded_features(path) for path in args.landmarks]))
+    else:
+        features = regressor.support_vectors
+    max_diff, ok = verify(model, regressor, features, args.tol)
+    print('Checked %d frames, max difference %.3g' % (len(features), max_diff))
+    if not ok:
+        sys.exit(1)
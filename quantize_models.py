@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import time
+import warnings
+import numpy as np
+import torch
+from torch import nn
+from classifier import CLFLSTM, HybridCNNLSTM, LSTMClassifier, WindowClassifier
+from model_registry import LSTM_MODELS, VARIANT_DIR, lstm_model_path
+from recorder import read_records, window_features
+from window import sub_windows, WINDOW_LENGTH, RUN_EVERY
+
+def benchmark_windows(n_frames=3000, recordings=(), seed=0, scales=(1.0, 2.0, 4.0)):
+    ''' Feature windows (B, 20, 4) the classifier sees every 15 frames: synthetic streams
+    (benchmark.synthetic_window_features) and the smoothed features of recorder.py recordings
+    :param scales: Amplitudes of the synthetic streams, the classifiers split them differently into drowsy / normal
+    '''
+    from benchmark import synthetic_window_features
+
+    sequences = [synthetic_window_features(n_frames, seed=seed, scale=scale) for scale in scales]
+    for path in recordings:
+        sequences.append(window_features(read_records(path)))
+    windows = [sequence[i:i + WINDOW_LENGTH] for sequence in sequences
+               for i in range(0, len(sequence) - WINDOW_LENGTH + 1, RUN_EVERY)]
+    return np.ascontiguousarray(np.stack(windows), dtype=np.float32)
+
+def load_models(name):
+    ''' Float32 eager module of a registered classifier, the module the runtime loads for it and its kind.
+    The runtime module is the TorchScript graph for clf_lstm and the eager rebuild for the HybridCNNLSTM
+    graphs (their graphs only run on cuda)
+    '''
+    kind = LSTM_MODELS[name][1]
+    scripted = torch.jit.load(lstm_model_path(name), map_location='cpu')
+    model = (CLFLSTM if kind == 'lstm' else HybridCNNLSTM).from_torchscript(scripted)
+    return model, scripted if kind == 'lstm' else model, kind
+
+def build_variants(model, example):
+    ''' CPU variants of an eager classifier module
+    :param example: Input of the runtime shape, used for tracing
+    :return: Dict variant name -> module, variants that cannot be built are left out
+    '''
+    variants = {}
+    with torch.inference_mode():
+        builders = {
+            'frozen': lambda: torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.trace(model, example))),
+            'int8': lambda: torch.jit.freeze(torch.jit.trace(
+                torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8), example)),
+        }
+        for name, build in builders.items():
+            try:
+                variants[name] = build()
+            except Exception as e:
+                print('  %s: cannot be built (%s)' % (name, e))
+    return variants
+
+def wrap(module, kind, num_threads, batch_model=None):
+    if kind == 'lstm':
+        return LSTMClassifier(module, num_threads=num_threads, batch_model=batch_model or module)
+    return WindowClassifier(module, num_threads=num_threads)
+
+def latency(classifier, windows, repeat=3):
+    ''' p50 / p95 latency (ms) of one classify() call, as in the live loop '''
+    for window in windows[:20]:
+        classifier.classify(window)
+    timings = []
+    for _ in range(repeat):
+        for window in windows:
+            start = time.perf_counter()
+            classifier.classify(window)
+            timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+def evaluate(name, windows, threads, tolerance, output_dir):
+    ''' Build, gate, time and save the variants of one classifier
+    :param tolerance: Largest fraction of drowsy/normal decisions a variant may change
+    :return: Manifest entry of the classifier
+    '''
+    model, runtime_model, kind = load_models(name)
+    example = torch.from_numpy(np.ascontiguousarray(sub_windows(windows[0]) if kind == 'lstm' else windows[:1]))
+    reference = wrap(model, kind, threads[0])
+    reference_labels = reference.classify_batch(windows)
+    reference_scores = reference.scores_batch(windows)
+    entry = {'kind': kind, 'windows': len(windows), 'drowsy': int(reference_labels.sum()), 'variants': [], 'selected': None}
+    if reference_labels.min() == reference_labels.max():
+        # a variant always answering the same label would pass
+        entry['error'] = 'the reference labels all %d windows %s, add --recordings with both labels' \
+                         % (len(windows), 'drowsy' if reference_labels[0] else 'normal')
+        return entry
+
+    candidates = dict(build_variants(model, example), original=runtime_model)
+    for variant, module in candidates.items():
+        batch_model = model if variant == 'original' else module
+        classifier = wrap(module, kind, threads[0], batch_model)
+        labels = classifier.classify_batch(windows)
+        scores = classifier.scores_batch(windows)
+        changed = float((labels != reference_labels).mean())
+        path = None
+        if variant != 'original':
+            path = '%s.%s.pt' % (name, variant)
+            torch.jit.save(module, os.path.join(output_dir, path))
+        for n_threads in threads:
+            p50, p95 = latency(wrap(module, kind, n_threads, batch_model), windows)
+            entry['variants'].append({
+                'variant': variant, 'path': path, 'threads': n_threads, 'p50_ms': p50, 'p95_ms': p95,
+                'changed_decisions': changed, 'max_score_diff': float(np.abs(scores - reference_scores).max()),
+                'passed': changed <= tolerance,
+            })
+    passed = [v for v in entry['variants'] if v['passed']]
+    entry['selected'] = min(passed, key=lambda v: v['p50_ms']) if passed else None
+    return entry
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category=UserWarning)
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    warnings.filterwarnings("ignore", category=DeprecationWarning) # torch.ao.quantization moves to torchao
+    parser = argparse.ArgumentParser(description='Build int8 / frozen CPU variants of the classifiers, gate them on the '
+                                                 'benchmark windows and write the manifest the runtime selects from')
+    parser.add_argument('--models', nargs='*', default=list(LSTM_MODELS), help='registered classifiers (%s)' % ', '.join(LSTM_MODELS))
+    parser.add_argument('--threads', type=int, nargs='*', default=[1, 2, 4], help='torch thread counts to time every variant with')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='largest fraction of changed drowsy/normal decisions')
+    parser.add_argument('--frames', type=int, default=3000, help='length of the synthetic feature stream')
+    parser.add_argument('--recordings', nargs='*', default=[], help='recorder.py files added to the benchmark windows')
+    parser.add_argument('--output-dir', default=VARIANT_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    windows = benchmark_windows(args.frames, args.recordings)
+    manifest = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'torch': torch.__version__, 'cpu_count': os.cpu_count(),
+                'tolerance': args.tolerance, 'models': {}}
+    for name in args.models:
+        print('%s: %d windows' % (name, len(windows)))
+        entry = evaluate(name, windows, args.threads, args.tolerance, args.output_dir)
+        manifest['models'][name] = entry
+        if 'error' in entry:
+            print('  not gated: %s' % entry['error'])
+        for v in entry['variants']:
+            print('  %-8s %d threads  p50 %.3fms  p95 %.3fms  %.2f%% decisions changed  %s'
+                  % (v['variant'], v['threads'], v['p50_ms'], v['p95_ms'], 100 * v['changed_decisions'],
+                     'ok' if v['passed'] else 'REJECTED'))
+        selected = entry['selected']
+        if selected is not None:
+            print('  selected %s with %d threads' % (selected['variant'], selected['threads']))
+    with open(os.path.join(args.output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+MAGIC = b'DRWREC01'
+HEADER_SIZE = 4096 # magic, record count, capacity, JSON dtype description; records start after it
+N_LANDMARKS = 468
+MODES = ('inference', 'paused', 'calibration') # value of the mode field
+
+def record_dtype(landmarks=False):
+    ''' Fixed-width record of one decision step
+    :param landmarks: Also store the normalized FaceMesh landmarks (468, 2) of the frame
+    '''
+    fields = [('time', '<f8'),
+              ('ear_main', '<f4'), ('mar_main', '<f4'), ('puc_main', '<f4'), ('moe_main', '<f4'), ('pitch_main', '<f4'),
+              ('count_decision', '<i2'), ('head_count', '<i2'),
+              ('label', 'i1'), # -1 before the first classification
+              ('head', 'i1'), ('alert', 'u1'), ('detected', 'u1'), ('classified', 'u1'),
+              ('repeated', 'u1'), # frame skipped by the scheduler, features repeated
+              ('mode', 'u1')] # index in MODES, the state fields are only meaningful for inference
+    if landmarks:
+        fields.append(('landmarks', '<f4', (N_LANDMARKS, 2)))
+    return np.dtype(fields)
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+        raise ValueError('%s is not a recording' % path)
+    count, capacity, length = np.frombuffer(header, dtype='<u8', count=3, offset=8)
+    info = json.loads(header[32:32 + int(length)].decode())
+    dtype = np.dtype([tuple(field[:2]) if len(field) == 2 else (field[0], field[1], tuple(field[2])) for field in info['fields']])
+    return int(count), int(capacity), dtype, info
+
+
+class Recorder:
+    ''' Always-on recorder of the decision state: fixed-width records in a preallocated ring file.
+    Records are written into a memory map (no syscall, no allocation per frame); once the file is full
+    the oldest records are overwritten. The record count in the header is bumped after the record is
+    written, so a crash never leaves a half-written record visible to the reader.
+    '''
+    def __init__(self, path, capacity=30 * 3600 * 8, landmarks=False):
+        '''
+        :param path: Recording file, reopened and continued if it exists with the same layout
+        :param capacity: Number of records kept (default 8 hours at 30 fps)
+        :param landmarks: Also record the FaceMesh landmarks (3.7 KB per frame)
+        '''
+        self.path = path
+        self.dtype = record_dtype(landmarks)
+        self.landmarks = landmarks
+        if os.path.exists(path):
+            count, stored_capacity, dtype, _ = _read_header(path)
+            if dtype != self.dtype or stored_capacity != capacity:
+                raise ValueError('%s was recorded with another layout or capacity, use another path' % path)
+        else:
+            self._create(path, capacity)
+        self.capacity = capacity
+        self.counter = np.memmap(path, dtype='<u8', mode='r+', offset=8, shape=(1,))
+        self.records = np.memmap(path, dtype=self.dtype, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+
+    def _create(self, path, capacity):
+        info = json.dumps({'fields': self.dtype.descr, 'created': time.time()}).encode()
+        if 32 + len(info) > HEADER_SIZE:
+            raise ValueError('record layout too large for the header')
+        header = bytearray(HEADER_SIZE)
+        header[:8] = MAGIC
+        header[8:32] = np.array([0, capacity, len(info)], dtype='<u8').tobytes()
+        header[32:32 + len(info)] = info
+        with open(path, 'wb') as f:
+            f.write(header)
+            size = HEADER_SIZE + capacity * self.dtype.itemsize
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size) # reserve the blocks now, no ENOSPC hours later
+            else:
+                f.truncate(size)
+
+    @property
+    def count(self):
+        return int(self.counter[0])
+
+    def write(self, state, detected, landmarks=None, repeated=False, timestamp=None, mode='inference'):
+        ''' Record one frame, in every mode
+        :param state: DrowsinessState after its step (or pause), None while calibrating
+        :param landmarks: Normalized (468, 2) landmarks of the frame, None if no face was found (or not recorded)
+        :param timestamp: Seconds since the epoch, default now
+        :param mode: One of MODES
+        '''
+        count = int(self.counter[0])
+        timestamp = time.time() if timestamp is None else timestamp
+        if state is None:
+            fields = (timestamp, np.nan, np.nan, np.nan, np.nan, np.nan, 0, 0, -1, 0, False, detected, False, repeated)
+        else:
+            fields = (timestamp,
+                      state.ear_main, state.mar_main, state.puc_main, state.moe_main, state.pitch_main,
+                      min(state.count_decision, 32767), min(state.head_count, 32767),
+                      -1 if state.label is None else state.label, state.head,
+                      state.alert, detected, state.classified, repeated)
+        fields += (MODES.index(mode),)
+        if self.landmarks:
+            fields += (np.nan if landmarks is None else landmarks,)
+        self.records[count % self.capacity] = fields
+        self.counter[0] = count + 1
+
+    def flush(self):
+        self.records.flush()
+        self.counter.flush()
+
+    def close(self):
+        self.flush()
+        del self.records, self.counter
+
+
+def read_records(path, start=None, end=None):
+    ''' Memory-map a recording and return its records in chronological order.
+    Without a time range, and before the ring wrapped around, the result is a view of the file
+    (nothing is read until it is used); otherwise only the selected records are copied.
+    :param start: First timestamp (seconds since the epoch) to return
+    :param end: Timestamp after the last record to return
+    :return: Structured array with the fields of record_dtype
+    '''
+    count, capacity, dtype, _ = _read_header(path)
+    records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(capacity,))
+    if count <= capacity:
+        segments = [records[:count]]
+    else:
+        segments = [records[count % capacity:], records[:count % capacity]]
+    selected = []
+    for segment in segments:
+        times = segment['time']
+        first = 0 if start is None else np.searchsorted(times, start)
+        last = len(segment) if end is None else np.searchsorted(times, end)
+        if last > first:
+            selected.append(segment[first:last])
+    if not selected:
+        return np.zeros(0, dtype=dtype)
+    return selected[0] if len(selected) == 1 else np.concatenate(selected)
+
+def window_features(records):
+    ''' Smoothed (ear, mar, puc, moe) of the inference records, as the FeatureWindow saw them
+    :return: Array of shape (N, 4)
+    '''
+    records = records[records['mode'] == MODES.index('inference')]
+    return np.stack([records[name] for name in ('ear_main', 'mar_main', 'puc_main', 'moe_main')], axis=1)
+
+def incidents(records, before=30.0, after=10.0):
+    ''' Records around every alert onset
+    :param before: Seconds kept before the alert went on
+    :param after: Seconds kept after the alert went off
+    :return: List of (onset timestamp, records)
+    '''
+    alert = records['alert'].astype(bool)
+    onsets = np.flatnonzero(alert[1:] & ~alert[:-1]) + 1
+    if len(alert) and alert[0]:
+        onsets = np.concatenate(([0], onsets))
+    offsets = np.flatnonzero(~alert[1:] & alert[:-1]) + 1
+    times = records['time']
+    result = []
+    for onset in onsets:
+        later = offsets[offsets > onset]
+        off = later[0] if len(later) else len(records) - 1
+        first = np.searchsorted(times, times[onset] - before)
+        last = np.searchsorted(times, times[off] + after, side='right')
+        result.append((times[onset], records[first:last]))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize a recording and export incidents for review or retraining')
+    parser.add_argument('path')
+    parser.add_argument('--before', type=float, default=30.0, help='seconds kept before each alert')
+    parser.add_argument('--after', type=float, default=10.0, help='seconds kept after each alert')
+    parser.add_argument('--export', help='save every incident to this .npz file (one structured array per incident)')
+    args = parser.parse_args()
+
+    records = read_records(args.path)
+    if not len(records):
+        print('%s: empty' % args.path)
+        raise SystemExit
+    span = records['time'][-1] - records['time'][0]
+    print('%s: %d records, %.1f min, %.1f%% with a face, %d alert frames, %s'
+          % (args.path, len(records), span / 60, 100 * records['detected'].mean(), int(records['alert'].sum()),
+             ', '.join('%d %s' % ((records['mode'] == i).sum(), mode) for i, mode in enumerate(MODES))))
+    found = incidents(records, args.before, args.after)
+    for onset, window in found:
+        alert = window[window['alert'] == 1]
+        print('  %s  alert for %.1f s, max count_decision %d, max head_count %d'
+              % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(onset)), alert['time'][-1] - alert['time'][0],
+                 window['count_decision'].max(), window['head_count'].max()))
+    if args.export:
+        np.savez_compressed(args.export, **{'incident_%d' % i: window for i, (_, window) in enumerate(found)})
+        print('%d incidents -> %s' % (len(found), args.export))
@@ -0,0 +1,72 @@
+import math
+import numpy as np
+from features import left_eye, right_eye, mouth
+
+# Scalar per-landmark implementation of the facial features, kept as the reference that
+# features.landmark_features is benchmarked and checked against (benchmark.py)
+
+def distance(p1, p2):
+    ''' Calculate distance between two points
+    :param p1: First Point 
+    :param p2: Second Point
+    :return: Euclidean distance between the points. (Using only the x and y coordinates).
+    '''
+    p1 = np.array(p1)  # Chuyển đổi nếu p1 là list hoặc tuple
+    p2 = np.array(p2)  # Chuyển đổi nếu p2 là list hoặc tuple
+    return np.linalg.norm(p1 - p2)
+
+def eye_aspect_ratio(landmarks, eye):
+    ''' Calculate the ratio of the eye length to eye width. 
+    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
+    :param eye: List containing positions which correspond to the eye
+    :return: Eye aspect ratio value
+    '''
+    N1 = distance(landmarks[eye[1][0]], landmarks[eye[1][1]])
+    N2 = distance(landmarks[eye[2][0]], landmarks[eye[2][1]])
+    N3 = distance(landmarks[eye[3][0]], landmarks[eye[3][1]])
+    D = distance(landmarks[eye[0][0]], landmarks[eye[0][1]])
+    return (N1 + N2 + N3) / (3 * D)
+
+def eye_feature(landmarks):
+    ''' Calculate the eye feature as the average of the eye aspect ratio for the two eyes
+    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
+    :return: Eye feature value
+    '''
+    return (eye_aspect_ratio(landmarks, left_eye) + \
+    eye_aspect_ratio(landmarks, right_eye))/2
+
+def mouth_feature(landmarks):
+    ''' Calculate mouth feature as the ratio of the mouth length to mouth width
+    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
+    :return: Mouth feature value
+    '''
+    N1 = distance(landmarks[mouth[1][0]], landmarks[mouth[1][1]])
+    N2 = distance(landmarks[mouth[2][0]], landmarks[mouth[2][1]])
+    N3 = distance(landmarks[mouth[3][0]], landmarks[mouth[3][1]])
+    D = distance(landmarks[mouth[0][0]], landmarks[mouth[0][1]])
+    return (N1 + N2 + N3)/(3*D)
+
+def pupil_circularity(landmarks, eye):
+    ''' Calculate pupil circularity feature.
+    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
+    :param eye: List containing positions which correspond to the eye
+    :return: Pupil circularity for the eye coordinates
+    '''
+    perimeter = distance(landmarks[eye[0][0]], landmarks[eye[1][0]]) + \
+            distance(landmarks[eye[1][0]], landmarks[eye[2][0]]) + \
+            distance(landmarks[eye[2][0]], landmarks[eye[3][0]]) + \
+            distance(landmarks[eye[3][0]], landmarks[eye[0][1]]) + \
+            distance(landmarks[eye[0][1]], landmarks[eye[3][1]]) + \
+            distance(landmarks[eye[3][1]], landmarks[eye[2][1]]) + \
+            distance(landmarks[eye[2][1]], landmarks[eye[1][1]]) + \
+            distance(landmarks[eye[1][1]], landmarks[eye[0][0]])
+    area = math.pi * ((distance(landmarks[eye[1][0]], landmarks[eye[3][1]]) * 0.5) ** 2)
+    return (4*math.pi*area)/(perimeter**2)
+
+def pupil_feature(landmarks):
+    ''' Calculate the pupil feature as the average of the pupil circularity for the two eyes
+    :param landmarks: Face Landmarks returned from FaceMesh MediaPipe model
+    :return: Pupil feature value
+    '''
+    return (pupil_circularity(landmarks, left_eye) + \
+        pupil_circularity(landmarks, right_eye))/2
@@ -0,0 +1,149 @@
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from features import landmark_features
+from pose_regressor import pose_features
+from model_registry import load_classifier, load_face_mesh, load_head_pose, LSTM_MODELS
+from decision import DrowsinessState, load_config
+from calibration import calibration_stats
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+# Loaded once per worker process by init_worker
+face_mesh = None
+model_head_pose = None
+classifier = None
+
+def init_worker(head_pose_path, lstm_path, torch_threads=1):
+    global face_mesh, model_head_pose, classifier
+    warnings.filterwarnings("ignore", category=UserWarning)
+    face_mesh = load_face_mesh()
+    model_head_pose = load_head_pose(head_pose_path)
+    classifier = load_classifier(lstm_path, num_threads=torch_threads)
+
+def find_videos(paths):
+    ''' Expand files and directories (recursively) into a sorted list of video files '''
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                videos.extend(os.path.join(root, name) for name in files if name.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            videos.append(path)
+    return sorted(videos)
+
+def extract_landmarks(path):
+    ''' Run FaceMesh over every frame of a video
+    :return: Normalized landmarks (N, 468, 2) with NaN rows where no face was found, detection mask (N,),
+        frame size (width, height) and frames per second
+    '''
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    landmarks = []
+    while True:
+        success, image = cap.read()
+        if not success:
+            break
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        results = face_mesh.process(image)
+        if results.multi_face_landmarks:
+            landmarks.append([[p.x, p.y] for p in results.multi_face_landmarks[0].landmark])
+        else:
+            landmarks.append(np.full((468, 2), np.nan))
+    cap.release()
+    landmarks = np.array(landmarks, dtype=np.float64).reshape(-1, 468, 2)
+    detected = ~np.isnan(landmarks[:, 0, 0])
+    return landmarks, detected, (width, height), fps
+
+def score_landmarks(landmarks, detected, width, height, calib_frame_count=150, frames_start=60,
+                    count_detect_drownsiness=None, decision_config=None):
+    ''' Featurize a whole recording at once, calibrate on its first frames and replay the decision logic
+    :param landmarks: Normalized landmarks (N, 468, 2)
+    :param detected: Face detection mask (N,)
+    :param decision_config: Decision thresholds (decision.load_config), count_detect_drownsiness overrides its value
+    :return: Dict of per-frame columns
+    '''
+    n_frames = len(landmarks)
+    features = np.full((n_frames, 4), -1000.0)
+    poses = np.zeros((n_frames, 3))
+    if detected.any():
+        found = landmarks[detected]
+        poses[detected] = model_head_pose.predict_pose(pose_features(found))
+        features[detected] = landmark_features(found * [width, height])
+
+    # Same calibration as calibrate(): skip frames_start frames, then use the detected ones out of calib_frame_count
+    calib = detected.copy()
+    calib[:frames_start] = False
+    calib[frames_start + calib_frame_count:] = False
+    if not calib.any():
+        raise ValueError('no face found in the calibration frames')
+    norms = calibration_stats(*features[calib].T, *poses[calib].T)
+
+    # the whole recording in one pass, every due window scored in one batch
+    state = DrowsinessState(*norms, classifier.classify, count_detect_drownsiness=count_detect_drownsiness,
+                            config=decision_config, classify_batch=classifier.classify_batch)
+    decisions = state.step_many(features, poses, detected)
+    columns = {name: decisions[name] for name in ['ear_main', 'mar_main', 'puc_main', 'moe_main', 'pitch_main']}
+
+    columns.update({
+        'frame': np.arange(n_frames), 'detected': detected,
+        'ear': features[:, 0], 'mar': features[:, 1], 'puc': features[:, 2], 'moe': features[:, 3],
+        'pitch': poses[:, 0], 'yaw': poses[:, 1], 'roll': poses[:, 2],
+        'head_count': decisions['head_count'].astype(np.int32), 'count_decision': decisions['count_decision'].astype(np.int32),
+        'label': decisions['label'], 'alert': decisions['alert'].astype(bool),
+    })
+    return columns
+
+def replay_video(path, output_dir, **kwargs):
+    ''' Score one recording and write its per-frame columns to <output_dir>/<name>.npz
+    :return: (output path, number of frames, number of alert frames, processing seconds, video seconds)
+    '''
+    start = time.time()
+    landmarks, detected, (width, height), fps = extract_landmarks(path)
+    columns = score_landmarks(landmarks, detected, width, height, **kwargs)
+    columns['time'] = columns['frame'] / fps
+    output = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.npz')
+    np.savez_compressed(output, **columns)
+    return output, len(landmarks), int(columns['alert'].sum()), time.time() - start, len(landmarks) / fps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-score recorded videos headless, faster than realtime')
+    parser.add_argument('paths', nargs='+', help='video files or directories of recordings')
+    parser.add_argument('--output-dir', default='replay_output', help='directory for the per-recording .npz columns')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--head-pose', default='head_pose.npz')
+    parser.add_argument('--lstm', default='clf_lstm', help='one of %s or a model path' % ', '.join(LSTM_MODELS))
+    parser.add_argument('--calib-frames', type=int, default=150)
+    parser.add_argument('--calib-skip', type=int, default=60)
+    parser.add_argument('--count-detect', type=int, help='consecutive drowsy decisions that trigger the alert (overrides --decision-config)')
+    parser.add_argument('--decision-config', help='JSON file overriding the decision thresholds (see decision.DEFAULT_CONFIG)')
+    args = parser.parse_args()
+
+    videos = find_videos(args.paths)
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = dict(calib_frame_count=args.calib_frames, frames_start=args.calib_skip,
+                   count_detect_drownsiness=args.count_detect, decision_config=load_config(args.decision_config))
+
+    total_processing, total_video = 0.0, 0.0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(args.head_pose, args.lstm)) as pool:
+        futures = {pool.submit(replay_video, path, args.output_dir, **options): path for path in videos}
+        for future in as_completed(futures):
+            try:
+                output, n_frames, n_alert, seconds, video_seconds = future.result()
+            except Exception as e:
+                print('%s: failed (%s)' % (futures[future], e))
+                continue
+            total_processing += seconds
+            total_video += video_seconds
+            print('%s: %d frames, %d alert frames, %.1fx realtime -> %s'
+                  % (futures[future], n_frames, n_alert, video_seconds / max(seconds, 1e-9), output))
+    print('Replayed %.0f s of video in %.0f s of worker time' % (total_video, total_processing))
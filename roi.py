@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+def landmark_array(face_landmarks):
+    ''' (468, 2) array of the normalized x, y of a FaceMesh landmark list '''
+    return np.array([[p.x, p.y] for p in face_landmarks.landmark])
+
+
+class ROITracker:
+    ''' Runs FaceMesh on a downsized crop around the face found in the previous frame.
+    Landmarks are mapped back to normalized full-frame coordinates, so everything after FaceMesh
+    (head pose, features, draw_axes, servo offsets) is unchanged. When the face is lost in the crop,
+    the same frame is processed again at full size.
+    Full frames go to their own FaceMesh instance: FaceMesh tracks its region of interest from one call to
+    the next, so one instance fed with crops and full frames in turn would start every switch from a
+    region in the other coordinate frame.
+    '''
+    def __init__(self, detector, margin=0.35, max_side=256, refresh_every=150):
+        '''
+        :param detector: FaceMesh instance for the full-frame detections, not the one process() gets for the crops
+        :param margin: Border added around the landmark bounding box, as a fraction of its largest side
+        :param max_side: Crops larger than this (pixels) are downsized before FaceMesh
+        :param refresh_every: Frames between two full-frame detections while the face is tracked in the crop
+            (0 to disable). The crop is kept when the full-frame detection finds no face
+        '''
+        self.detector = detector
+        self.margin = margin
+        self.max_side = max_side
+        self.refresh_every = refresh_every
+        self.roi = None # (x0, y0, x1, y1) in pixels, None for full frame
+        self.frames = 0
+        self.crop_frames = 0
+        self.fallbacks = 0
+
+    def reset(self):
+        self.roi = None
+
+    def _next_roi(self, landmarks, width, height):
+        x_min, y_min = landmarks.min(axis=0) * [width, height]
+        x_max, y_max = landmarks.max(axis=0) * [width, height]
+        side = max(x_max - x_min, y_max - y_min) * (1 + 2 * self.margin)
+        side = int(min(max(side, 32), width, height))
+        x0 = int(np.clip((x_min + x_max - side) / 2, 0, width - side))
+        y0 = int(np.clip((y_min + y_max - side) / 2, 0, height - side))
+        return x0, y0, x0 + side, y0 + side
+
+    def process(self, face_mesh, image, remap_landmarks=False):
+        ''' Run FaceMesh on the region of interest of an RGB frame
+        :param face_mesh: FaceMesh instance for the crops
+        :param image: RGB frame
+        :param remap_landmarks: Also rewrite the returned landmark list to full-frame coordinates (needed to draw it)
+        :return: FaceMesh landmark list of the first face (or None) and its normalized full-frame landmarks (468, 2)
+        '''
+        height, width = image.shape[:2]
+        self.frames += 1
+        refresh = self.refresh_every and self.frames % self.refresh_every == 0
+
+        face, landmarks = None, None
+        if self.roi is not None and not refresh:
+            face, landmarks = self._process_crop(face_mesh, image, remap_landmarks)
+            if face is None:
+                self.fallbacks += 1
+
+        if face is None:
+            results = self.detector.process(image)
+            if results.multi_face_landmarks:
+                face = results.multi_face_landmarks[0]
+                landmarks = landmark_array(face)
+            elif refresh and self.roi is not None:
+                face, landmarks = self._process_crop(face_mesh, image, remap_landmarks)
+
+        self.roi = None if face is None else self._next_roi(landmarks, width, height)
+        return face, landmarks
+
+    def _process_crop(self, face_mesh, image, remap_landmarks):
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = self.roi
+        crop = image[y0:y1, x0:x1]
+        if x1 - x0 > self.max_side:
+            crop = cv2.resize(crop, (self.max_side, self.max_side), interpolation=cv2.INTER_AREA)
+        results = face_mesh.process(np.ascontiguousarray(crop))
+        if not results.multi_face_landmarks:
+            return None, None
+        self.crop_frames += 1
+        face = results.multi_face_landmarks[0]
+        landmarks = landmark_array(face)
+        # crop-normalized -> full-frame normalized
+        landmarks *= [(x1 - x0) / width, (y1 - y0) / height]
+        landmarks += [x0 / width, y0 / height]
+        if remap_landmarks:
+            for point, (x, y) in zip(face.landmark, landmarks):
+                point.x, point.y = x, y
+        return face, landmarks
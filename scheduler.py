@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+
+# (analyze every n-th camera frame, classify every n camera frames), from full rate to most relaxed
+LEVELS = ((1, 15), (2, 30), (3, 45))
+
+class AdaptiveScheduler:
+    ''' Lowers the analysis and classification rate while the driver is clearly alert and
+    goes back to full rate on the first frame with any risk signal.
+    Skipped frames are only grabbed (not decoded, no FaceMesh), the decision logic repeats the
+    features of the last analyzed frame so the LSTM window still covers the same time span.
+    should_analyze runs on the capture thread and update on the decision thread, the level and counters
+    are guarded by a lock.
+    '''
+    def __init__(self, levels=LEVELS, calm_frames=300, ear_low=-1.0, mar_high=1.5, ear_drop=0.75,
+                 trend_frames=30, risk_score=0.3):
+        '''
+        :param levels: (analyze_every, run_every) per level, level 0 is full rate
+        :param calm_frames: Camera frames without risk signal before stepping down one level
+        :param ear_low: Smoothed normalized EAR below which the eyes count as closing
+        :param mar_high: Smoothed normalized MAR above which the mouth counts as yawning
+        :param ear_drop: Drop of the smoothed EAR between the two halves of the last trend_frames camera frames that counts as a risk
+        :param risk_score: LSTM score above which a sub-window counts as a risk even if it does not vote drowsy
+        '''
+        self.levels = levels
+        self.calm_frames = calm_frames
+        self.ear_low = ear_low
+        self.mar_high = mar_high
+        self.ear_drop = ear_drop
+        self.risk_score = risk_score
+        self.level = 0
+        self.calm = 0
+        self.frame = 0
+        self.skipped = 0
+        self.ears = deque(maxlen=trend_frames)
+        self._lock = threading.Lock()
+
+    @property
+    def analyze_every(self):
+        return self.levels[self.level][0]
+
+    @property
+    def run_every(self):
+        return self.levels[self.level][1]
+
+    def should_analyze(self):
+        ''' Called once per camera frame
+        :return: False if the frame can be skipped
+        '''
+        with self._lock:
+            self.frame += 1
+            if self.frame % self.analyze_every == 0:
+                return True
+            self.skipped += 1
+            return False
+
+    def risk(self, state, detected, scores=None):
+        ''' Whether the current state shows any sign of drowsiness '''
+        if not detected or state.alert or state.count_decision > 0 or state.head == 1 or state.head_count > 0:
+            return True
+        if state.label == 1 or (scores is not None and (scores > self.risk_score).any()):
+            return True
+        if state.ear_main < self.ear_low or state.mar_main > self.mar_high:
+            return True
+        if len(self.ears) < self.ears.maxlen:
+            return False
+        # EAR trend: mean of the older half of the recent frames against the newer half
+        ears = list(self.ears)
+        half = len(ears) // 2
+        return sum(ears[:half]) / half - sum(ears[half:]) / (len(ears) - half) > self.ear_drop
+
+    def update(self, state, detected, scores=None):
+        ''' Adapt the rates after the decision step of a camera frame (analyzed or repeated)
+        :param state: DrowsinessState after the step of this frame
+        :param scores: LSTM scores of the last classification, if it ran in this step
+        :return: Current level
+        '''
+        if detected:
+            self.ears.append(state.ear_main)
+        risk = self.risk(state, detected, scores)
+        with self._lock:
+            if risk:
+                self.level = 0
+                self.calm = 0
+            else:
+                self.calm += 1
+                if self.calm >= self.calm_frames and self.level < len(self.levels) - 1:
+                    self.level += 1
+                    self.calm = 0
+            level = self.level
+        # the window belongs to the decision thread, which calls update
+        state.window.run_every = self.levels[level][1]
+        return level
+
+    def reset(self):
+        with self._lock:
+            self.level = 0
+            self.calm = 0
+        self.ears.clear()
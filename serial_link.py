@@ -0,0 +1,244 @@
+import queue
+import threading
+import time
+import serial
+
+def parse_message(line):
+    ''' Parse one line sent by a sketch using the text protocol.
+    :param line: Decoded line without the trailing newline
+    :return: ('servo', x, y) for the "x,y" angle echo, ('button', flag1, flag2) for "10"/"01", None otherwise
+    '''
+    if line.count(",") == 1:
+        try:
+            x, y = map(int, line.split(','))
+        except ValueError:
+            return None
+        return ('servo', x, y)
+    if line in ['01', '10']:
+        return ('button', int(line[0]), int(line[1]))
+    return None
+
+def encode_text_command(alert, servo_x, servo_y):
+    ''' Command line of the text protocol of earlier sketch versions: "alert,x,y" '''
+    return f"{int(alert)},{int(servo_x)},{int(servo_y)}\n".encode('utf-8')
+
+# Binary protocol of sketch_nov14a.ino, 5-byte frames in both directions: SYNC, type, a, b, type ^ a ^ b
+SYNC = 0xA5
+COMMAND = 0x10 # host -> Arduino: type | alert, a = servo x, b = servo y
+ANGLES = 0x20  # Arduino -> host: a = servo x, b = servo y (reply to every command)
+BUTTONS = 0x30 # Arduino -> host: a = button 1 (running), b = button 2 (running_inference)
+READY = 0x40   # Arduino -> host: sketch (re)started, a = servo x, b = servo y (home position, alert off)
+FRAME_SIZE = 5
+
+def encode_frame(kind, a, b):
+    return bytes((SYNC, kind, a, b, kind ^ a ^ b))
+
+def encode_command(alert, servo_x, servo_y):
+    ''' Binary command frame, the angles are clamped to 0..180 '''
+    return encode_frame(COMMAND | int(bool(alert)), max(0, min(int(servo_x), 180)), max(0, min(int(servo_y), 180)))
+
+
+class FrameDecoder:
+    ''' Splits the byte stream of the binary protocol into frames. Bytes before a SYNC and frames with a bad
+    checksum are skipped, so the decoder resynchronizes by itself after a partial or corrupted frame
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        ''' Add received bytes
+        :return: List of complete frames (type, a, b)
+        '''
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                self.buffer.clear()
+                return frames
+            if len(self.buffer) - start < FRAME_SIZE:
+                del self.buffer[:start]
+                return frames
+            _, kind, a, b, check = self.buffer[start:start + FRAME_SIZE]
+            if kind ^ a ^ b != check:
+                self.errors += 1
+                del self.buffer[:start + 1]
+                continue
+            frames.append((kind, a, b))
+            del self.buffer[:start + FRAME_SIZE]
+
+def frame_event(kind, a, b):
+    ''' Event of a frame received from the Arduino, same tuples as parse_message '''
+    if kind == ANGLES:
+        return ('servo', a, b)
+    if kind == READY:
+        return ('ready', a, b)
+    if kind == BUTTONS:
+        return ('button', a, b)
+    return None
+
+
+class SerialLink:
+    ''' Non-blocking Arduino link.
+    A reader thread owns the port: it (re)connects in the background and turns incoming frames into
+    events. A writer thread sends commands at most max_rate times per second. Commands are coalesced,
+    only the newest pending command is written, so the frame loop never waits on the serial port.
+    Every (re)connection is reported as a ('connected', None, None) event: opening the port resets the
+    Arduino, which forgets the last command.
+    '''
+    def __init__(self, port='COM9', baudrate=19200, reconnect_delay=1.0, read_timeout=0.1, max_rate=20.0, protocol='binary'):
+        '''
+        :param max_rate: Commands written per second at most, newer commands replace the pending one meanwhile
+        :param protocol: 'binary' (sketch_nov14a.ino) or 'text' for sketches flashed before the binary protocol
+        '''
+        if protocol not in ('binary', 'text'):
+            raise ValueError("protocol must be 'binary' or 'text', got %r" % protocol)
+        self.port = port
+        self.baudrate = baudrate
+        self.reconnect_delay = reconnect_delay
+        self.read_timeout = read_timeout
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.protocol = protocol
+        self.events = queue.Queue()
+        self.commands_sent = 0
+        self.commands_coalesced = 0
+        self.bytes_sent = 0
+        self._decoder = FrameDecoder()
+        self._lines = bytearray() # text protocol: bytes of the line not terminated yet
+        self._encode = encode_command if protocol == 'binary' else encode_text_command
+        self._last_write = 0.0
+        self._serial = None
+        self._pending = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, name='serial-reader', daemon=True)
+        self._writer = threading.Thread(target=self._write_loop, name='serial-writer', daemon=True)
+
+    @property
+    def connected(self):
+        return self._serial is not None
+
+    def start(self):
+        self._reader.start()
+        self._writer.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in (self._reader, self._writer):
+            if thread.is_alive():
+                thread.join(timeout=2)
+        self._disconnect()
+
+    def send(self, alert, servo_x, servo_y):
+        ''' Queue a command for the Arduino. A command still pending from an earlier call is replaced.
+        :param alert: Alert flag (drives the buzzer/light output)
+        :param servo_x: Target angle for the X servo
+        :param servo_y: Target angle for the Y servo
+        '''
+        with self._cond:
+            if self._pending is not None:
+                self.commands_coalesced += 1
+            self._pending = self._encode(alert, servo_x, servo_y)
+            self._cond.notify()
+
+    def poll_events(self):
+        ''' Return all events received since the last call without blocking '''
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def wait_event(self, timeout=None):
+        ''' Block until an event arrives
+        :return: The event, or None on timeout
+        '''
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _connect(self):
+        while not self._stop.is_set():
+            try:
+                connection = serial.serial_for_url(self.port, baudrate=self.baudrate, timeout=self.read_timeout)
+                # partial frame / line of the previous connection
+                self._lines.clear()
+                self._decoder.buffer.clear()
+                with self._cond:
+                    self._serial = connection
+                    self._cond.notify()
+                self.events.put(('connected', None, None))
+                return
+            except serial.SerialException:
+                print("Lỗi kết nối với Arduino. Đang thử lại...")
+                self._stop.wait(self.reconnect_delay)
+
+    def _disconnect(self):
+        with self._cond:
+            connection, self._serial = self._serial, None
+        if connection is not None:
+            try:
+                connection.close()
+            except serial.SerialException:
+                pass
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            if self._serial is None:
+                self._connect()
+                continue
+            try:
+                data = self._serial.read(max(self._serial.in_waiting, 1))
+            except (serial.SerialException, OSError):
+                self._disconnect()
+                continue
+            if not data:
+                continue
+            if self.protocol == 'binary':
+                events = [frame_event(*frame) for frame in self._decoder.feed(data)]
+            else:
+                events = [parse_message(line.decode('utf-8', errors='ignore').strip()) for line in self._split_lines(data)]
+            for event in events:
+                if event is not None:
+                    self.events.put(event)
+
+    def _split_lines(self, data):
+        ''' Complete lines of the text protocol, a read timeout can end a read in the middle of a line '''
+        self._lines += data
+        *lines, rest = self._lines.split(b'\n')
+        self._lines = bytearray(rest)
+        return lines
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._stop.is_set():
+                    if self._pending is None or self._serial is None:
+                        self._cond.wait(timeout=0.5)
+                        continue
+                    # rate cap: commands queued meanwhile are coalesced into the newest one
+                    wait = self._last_write + self.min_interval - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(timeout=wait)
+                if self._stop.is_set():
+                    return
+                data, self._pending = self._pending, None
+                connection = self._serial
+            try:
+                connection.write(data)
+                self._last_write = time.monotonic()
+                self.commands_sent += 1
+                self.bytes_sent += len(data)
+            except (serial.SerialException, OSError):
+                # keep the command unless a newer one arrived meanwhile, the reader reconnects
+                with self._cond:
+                    if self._pending is None:
+                        self._pending = data
+                time.sleep(self.reconnect_delay)
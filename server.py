@@ -0,0 +1,115 @@
+import argparse
+import os
+import signal
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from calibration import CalibrationStore
+from decision import load_config
+from classifier import BatchClassifier
+from metrics import metrics
+from recorder import Recorder
+from model_registry import ModelRegistry, load_face_mesh, LSTM_MODELS
+from serial_link import SerialLink
+from session import Session
+
+running = True
+
+def parse_stream(spec):
+    ''' Parse a --stream value "name=source[,serial_port]"
+    :return: name, cv2.VideoCapture source (int for a camera index), serial port or None
+    '''
+    name, _, rest = spec.partition('=')
+    if not rest:
+        raise argparse.ArgumentTypeError('expected name=source[,serial_port], got %r' % spec)
+    source, _, port = rest.partition(',')
+    return name, int(source) if source.isdigit() else source, port or None
+
+def run_sessions(sessions, workers):
+    ''' Step every session on a pool of worker threads until all streams ended or running is cleared.
+    A session is stepped again as soon as its previous frame is done, so a slow cabin never blocks the others.
+    '''
+    pending = {}
+    active = list(sessions)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='session') as pool:
+        while running and (active or pending):
+            for session in active:
+                if session not in pending:
+                    pending[session] = pool.submit(session.step)
+            done, _ = wait(list(pending.values()), timeout=0.5, return_when=FIRST_COMPLETED)
+            for session, future in list(pending.items()):
+                if future not in done:
+                    continue
+                del pending[session]
+                try:
+                    alive = future.result()
+                except Exception as e:
+                    print('%s: stopped (%s)' % (session.name, e))
+                    alive = False
+                if not alive:
+                    print('%s: stream ended' % session.name)
+                    active.remove(session)
+        wait(list(pending.values()))
+
+def shutdown(signum, frame):
+    global running
+    running = False
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category=UserWarning)
+    parser = argparse.ArgumentParser(description='Monitor several cameras / drivers with one set of models')
+    parser.add_argument('--stream', dest='streams', type=parse_stream, action='append', required=True,
+                        help='name=source[,serial_port], e.g. bus1=0,COM9 or cab2=rtsp://10.0.0.2/live (repeatable)')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per stream)')
+    parser.add_argument('--lstm', default='clf_lstm', help='one of %s or a model path' % ', '.join(LSTM_MODELS))
+    parser.add_argument('--torch-threads', type=int, help='default 1, or the count --lstm-variant was tuned with')
+    parser.add_argument('--lstm-variant', help="'auto' or a variant built by quantize_models.py")
+    parser.add_argument('--head-pose', default='head_pose.npz')
+    parser.add_argument('--max-wait', type=float, default=0.005, help='seconds a classification waits to be batched with others')
+    parser.add_argument('--calibration-store', default='calibration.json')
+    parser.add_argument('--serial-protocol', choices=['binary', 'text'], default='binary',
+                        help='binary for sketch_nov14a.ino, text for Arduinos still flashed with the "alert,x,y" sketch')
+    parser.add_argument('--serial-rate', type=float, default=20.0, help='servo commands sent per second at most, per stream')
+    parser.add_argument('--record-dir', help='record the decision state of every stream to DIR/<name>.rec')
+    parser.add_argument('--record-hours', type=float, default=8, help='hours (at 30 fps) kept per recording')
+    parser.add_argument('--decision-config', help='JSON file overriding the decision thresholds (see decision.DEFAULT_CONFIG)')
+    parser.add_argument('--metrics-port', type=int)
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    registry = ModelRegistry(args.lstm, head_pose=args.head_pose, torch_threads=args.torch_threads, variant=args.lstm_variant)
+    registry.start(['head_pose', 'classifier'])
+    batch = BatchClassifier(registry.get('classifier'), max_batch=len(args.streams), max_wait=args.max_wait)
+    metrics.counter_fn('lstm_batches_total', lambda: batch.batches)
+    metrics.counter_fn('lstm_windows_total', lambda: batch.windows)
+    store = CalibrationStore(args.calibration_store)
+    decision_config = load_config(args.decision_config)
+
+    sessions = []
+    for name, source, port in args.streams:
+        serial = None
+        if port:
+            serial = SerialLink(port, baudrate=19200, max_rate=args.serial_rate, protocol=args.serial_protocol).start()
+        recorder = None
+        if args.record_dir:
+            os.makedirs(args.record_dir, exist_ok=True)
+            recorder = Recorder(os.path.join(args.record_dir, name + '.rec'), capacity=int(args.record_hours * 3600 * 30))
+        sessions.append(Session(name, source, load_face_mesh(), registry.get('head_pose'), batch.classify,
+                                serial=serial, store=store, recorder=recorder,
+                                decision_config=decision_config).open())
+    print('Serving %d streams' % len(sessions))
+    start = time.time()
+    try:
+        run_sessions(sessions, args.workers or len(sessions))
+    finally:
+        for session in sessions:
+            session.close()
+        batch.close()
+        elapsed = time.time() - start
+        for session in sessions:
+            print('%s: %d frames, %.1f fps' % (session.name, session.frames, session.frames / max(elapsed, 1e-9)))
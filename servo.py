@@ -0,0 +1,120 @@
+import time
+import numpy as np
+
+class ServoTracker:
+    ''' Pan/tilt controller that keeps the nose in the image center.
+    The nose offset is turned into an absolute bearing (servo angle + offset in degrees), so the camera's own
+    motion does not look like face motion. An alpha-beta filter tracks the bearing and its velocity and the target
+    is set to the bearing predicted `latency` seconds ahead. The servo angle is modelled by slewing towards the
+    last command at the sketch's rate and resynced with the angles the Arduino reports.
+    A deadband with hysteresis keeps the servos still for small offsets, and a command is only emitted when the
+    integer target angles or the alert flag change.
+    '''
+    def __init__(self, width, height, fov=(60.0, 40.0), gain=0.8, deadband=10, latency=0.1, slew_rate=50.0,
+                 alpha=0.5, beta=0.1, direction=(-1, -1), angle_x=135, angle_y=135, limits=(0, 180), resync=2.0):
+        '''
+        :param width: Frame width in pixels
+        :param height: Frame height in pixels
+        :param fov: Horizontal and vertical field of view of the camera in degrees
+        :param gain: Fraction of the predicted error corrected by one command
+        :param deadband: Offset (pixels) the nose may have from the center before the servos move.
+            Tracking stops again once the offset is below half of it
+        :param latency: Seconds between a frame and the servo reaching its target, the bearing is predicted that far
+        :param slew_rate: Degrees per second the sketch moves the servos towards the target (1 degree every 20 ms)
+        :param alpha: Position gain of the alpha-beta filter
+        :param beta: Velocity gain of the alpha-beta filter
+        :param direction: Sign of the servo angle change that moves the image content right / down
+        :param angle_x: Servo angles assumed until the Arduino reports them, and after it restarted
+            (home position of sketch_nov14a.ino)
+        :param limits: Servo angle range
+        :param resync: Degrees a reported angle may differ from the modelled one before the face track is restarted
+        '''
+        self.degrees_per_pixel = np.array([fov[0] / width, fov[1] / height])
+        self.gain = gain
+        self.deadband = deadband
+        self.latency = latency
+        self.slew_rate = slew_rate
+        self.alpha = alpha
+        self.beta = beta
+        self.direction = np.array(direction, dtype=np.float64)
+        self.limits = limits
+        self.resync = resync
+        self.home = (angle_x, angle_y)
+        self.angle = np.array([angle_x, angle_y], dtype=np.float64) # modelled servo angles
+        self.target = self.angle.round().astype(int)                 # last commanded angles
+        self.alert = None                                             # last commanded alert flag
+        self.tracking = False
+        self.bearing = None
+        self.velocity = np.zeros(2)
+        self.last_time = None
+        self.commands = 0
+
+    def reset(self):
+        ''' Forget the face track (face lost, inference restarted), keep the servo state '''
+        self.tracking = False
+        self.bearing = None
+        self.velocity[:] = 0
+
+    def sync(self, angle_x, angle_y):
+        ''' Servo angles reported by the Arduino '''
+        correction = np.abs(np.array([angle_x, angle_y]) - self.angle).max()
+        self.angle[:] = angle_x, angle_y
+        if correction > self.resync:
+            # the model was off (startup, servo moved by hand): the bearings so far were measured with wrong angles
+            self.reset()
+
+    def reconnected(self, angle_x=None, angle_y=None):
+        ''' The Arduino was (re)connected or restarted: it is back at its home position with the alert off,
+        so the next update sends the alert and the target again
+        :param angle_x: Servo angles it reported, default the home position
+        '''
+        self.target = np.array(self.home if angle_x is None else (angle_x, angle_y)).round().astype(int)
+        self.angle[:] = self.target
+        self.alert = None
+        self.reset()
+
+    def _advance(self, timestamp):
+        dt = 0.0 if self.last_time is None else max(timestamp - self.last_time, 0.0)
+        self.last_time = timestamp
+        step = self.slew_rate * dt
+        self.angle += np.clip(self.target - self.angle, -step, step)
+        return dt
+
+    def update(self, offset, alert, timestamp=None):
+        ''' Process the nose offset of one frame
+        :param offset: (delta_x, delta_y) of the nose from the image center in pixels, None if no face was found
+        :param alert: Alert flag to send with the command
+        :param timestamp: Capture time of the frame (time.perf_counter), default now
+        :return: (alert, servo_x, servo_y) to send, None if the Arduino already has this command
+        '''
+        dt = self._advance(time.perf_counter() if timestamp is None else timestamp)
+        target = self.target
+        if offset is None:
+            self.reset()
+        else:
+            offset = np.asarray(offset, dtype=np.float64)
+            bearing = self.angle + self.direction * offset * self.degrees_per_pixel
+            if self.bearing is None or dt <= 0:
+                self.bearing = bearing
+            else:
+                # alpha-beta filter of the face bearing
+                predicted = self.bearing + self.velocity * dt
+                residual = bearing - predicted
+                self.bearing = predicted + self.alpha * residual
+                self.velocity += self.beta * residual / dt
+
+            distance = np.abs(offset).max()
+            if distance > self.deadband:
+                self.tracking = True
+            elif distance < self.deadband / 2:
+                self.tracking = False
+            if self.tracking:
+                error = self.bearing + self.velocity * self.latency - self.angle
+                target = np.clip(self.angle + self.gain * error, *self.limits).round().astype(int)
+
+        if self.alert == bool(alert) and np.array_equal(target, self.target):
+            return None
+        self.target = target
+        self.alert = bool(alert)
+        self.commands += 1
+        return self.alert, int(target[0]), int(target[1])
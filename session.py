@@ -0,0 +1,220 @@
+import threading
+import time
+import cv2
+import numpy as np
+from features import landmark_features
+from pose_regressor import pose_features
+from roi import landmark_array
+from decision import DrowsinessState
+from calibration import calibration_stats, RunningStats
+from metrics import metrics
+from servo import ServoTracker
+
+NOSE = 1
+
+class Session:
+    ''' One monitored stream: camera, driver calibration, decision state and (optional) Arduino link.
+    Everything inference1 keeps in module globals (alert, running, running_inference, detect, servo angles)
+    lives here, so one process can serve several cabins. The FaceMesh graph is per session (it tracks the
+    face between frames), the head-pose model and the classifier are shared.
+    '''
+    def __init__(self, name, source, face_mesh, head_pose_model, classify, serial=None, store=None, recorder=None,
+                 width=1280, height=720, calib_frame_count=150, frames_start=60, count_detect_drownsiness=None,
+                 max_drift=3.0, min_drift_samples=150, decision_config=None, min_calib_samples=50):
+        '''
+        :param name: Stream name, also the driver profile in the calibration store
+        :param source: cv2.VideoCapture source (camera index, file or URL)
+        :param face_mesh: FaceMesh instance owned by this session
+        :param head_pose_model: Shared HeadPoseRegressor
+        :param classify: Shared classification function (e.g. BatchClassifier.classify)
+        :param serial: Optional started SerialLink of this cabin
+        :param store: Optional CalibrationStore
+        :param recorder: Optional Recorder of the decision state of this stream
+        :param decision_config: Decision thresholds (decision.load_config), count_detect_drownsiness overrides its value
+        :param min_calib_samples: Frames with a face needed to calibrate, calibration goes on past calib_frame_count
+            until that many were collected
+        '''
+        self.name = name
+        self.source = source
+        self.face_mesh = face_mesh
+        self.head_pose_model = head_pose_model
+        self.classify = classify
+        self.serial = serial
+        self.store = store
+        self.recorder = recorder
+        self.width = width
+        self.height = height
+        self.calib_frame_count = calib_frame_count
+        self.frames_start = frames_start
+        self.count_detect_drownsiness = count_detect_drownsiness
+        self.decision_config = decision_config
+        self.max_drift = max_drift
+        self.min_drift_samples = min_drift_samples
+        self.min_calib_samples = min_calib_samples
+
+        self.cap = None
+        self.running = True
+        self.running_inference = True
+        self.alert = False
+        self.detect = False
+        self.frames = 0
+        self.empty_frames = 0
+        self.servo = ServoTracker(width, height)
+        self.landmarks = None # normalized landmarks of the last frame, only kept for the recorder
+        self.profile = None
+        self.session_stats = RunningStats()
+        self.state = None
+        self.calib_frames = 0
+        self.calib_samples = []
+        self.lock = threading.Lock() # one step at a time, FaceMesh graphs are not thread-safe
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.source)
+        self.cap.set(3, self.width)
+        self.cap.set(4, self.height)
+        self._start()
+        return self
+
+    def _start(self):
+        ''' (Re)start monitoring: use the stored profile of the driver or calibrate during the next frames '''
+        self.profile = self.store.load(self.name) if self.store is not None else None
+        self.state = None
+        self.calib_frames = 0
+        self.calib_samples = []
+        self.session_stats = RunningStats()
+        if self.profile is not None:
+            self._start_inference()
+
+    def _start_inference(self):
+        self.state = DrowsinessState(*self.profile.norms(), self.classify,
+                                     count_detect_drownsiness=self.count_detect_drownsiness,
+                                     config=self.decision_config)
+
+    def analyze(self, image):
+        ''' FaceMesh, head pose and facial features of one BGR frame
+        :return: (ear, mar, puc, moe, pitch, yaw, roll) or None if no face was found, and the nose position in pixels
+        '''
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        rgb.flags.writeable = False
+        with metrics.timer('stage', stage='facemesh', stream=self.name):
+            results = self.face_mesh.process(rgb)
+        self.landmarks = None
+        if not results.multi_face_landmarks:
+            return None, None
+        landmarks = landmark_array(results.multi_face_landmarks[0])
+        pitch, yaw, roll = self.head_pose_model.predict_pose(pose_features(landmarks))[0]
+        if self.recorder is not None and self.recorder.landmarks:
+            self.landmarks = landmarks.astype(np.float32)
+        landmarks *= [self.width, self.height]
+        ear, mar, puc, moe = landmark_features(landmarks)
+        return (ear, mar, puc, moe, pitch, yaw, roll), (int(landmarks[NOSE][0]), int(landmarks[NOSE][1]))
+
+    def step(self):
+        ''' Process one frame of the stream
+        :return: False once the stream has ended
+        '''
+        with self.lock:
+            self._poll_serial()
+            if not self.running:
+                time.sleep(0.05)
+                return True
+            success, image = self.cap.read()
+            if not success:
+                self.empty_frames += 1
+                return self.cap.isOpened() and self.empty_frames < 100
+            self.empty_frames = 0
+            self.frames += 1
+            metrics.inc('frames_total', stream=self.name)
+
+            features, nose = self.analyze(image)
+            self.detect = features is not None
+            if self.state is None:
+                self._calibrate(features)
+                mode = 'calibration'
+            elif self.running_inference:
+                self._decide(features)
+                mode = 'inference'
+            else:
+                self.state.pause()
+                self.alert = False
+                mode = 'paused'
+            if self.recorder is not None:
+                # after _decide, which may restart the calibration (state None)
+                self.recorder.write(self.state, self.detect, landmarks=self.landmarks, mode=mode if self.state is not None else 'calibration')
+            self._send_servo(nose)
+            return True
+
+    def _calibrate(self, features):
+        self.calib_frames += 1
+        if features is not None and self.calib_frames > self.frames_start:
+            self.calib_samples.append(features)
+        if self.calib_frames >= self.frames_start + self.calib_frame_count and \
+                len(self.calib_samples) >= self.min_calib_samples:
+            norms = calibration_stats(*np.array(self.calib_samples).T)
+            self.profile = RunningStats.from_norms(norms, count=len(self.calib_samples))
+            if self.store is not None:
+                self.store.save(self.name, self.profile)
+            print('%s: calibrated on %d frames' % (self.name, len(self.calib_samples)))
+            self._start_inference()
+
+    def _decide(self, features):
+        previous_alert = self.alert
+        if features is None:
+            self.alert = self.state.step(-1000, -1000, -1000, -1000, 0, 0, 0, False)
+        else:
+            self.alert = self.state.step(*features, True)
+            state = self.state
+            if not self.alert and state.label != 1 and state.head == 0:
+                self.session_stats.update(*features)
+        if self.alert != previous_alert:
+            metrics.inc('alert_transitions_total', stream=self.name, to='on' if self.alert else 'off')
+            if self.alert:
+                print("%s: CẢNH BÁO CẢNH BÁO, người dùng đang buồn ngủ" % self.name)
+        metrics.set('alert', int(self.alert), stream=self.name)
+        if self.state.classified:
+            metrics.inc('decisions_total', stream=self.name, label=self.state.label)
+            if self.session_stats.count >= self.min_drift_samples:
+                if self.session_stats.drift(self.profile) > self.max_drift:
+                    print('%s: calibration drifted, recalibrating' % self.name)
+                    if self.store is not None:
+                        self.store.evict(self.name)
+                    self._start()
+                else:
+                    self.state.set_norms(*self.profile.merged(self.session_stats).norms())
+
+    def _poll_serial(self):
+        if self.serial is None:
+            return
+        for kind, a, b in self.serial.poll_events():
+            if kind == 'button':
+                if b == 1:
+                    self.running_inference = not self.running_inference
+                if a == 1:
+                    self.running = not self.running
+                    self.alert = False
+                    if self.running:
+                        self.running_inference = True
+                        self._start()
+            elif kind == 'servo':
+                self.servo.sync(a, b)
+            else:
+                self.servo.reconnected(a, b) # Arduino restarted, resend alert and target
+
+    def _send_servo(self, nose):
+        if self.serial is None:
+            return
+        offset = None if nose is None else (nose[0] - self.width // 2, nose[1] - self.height // 2)
+        command = self.servo.update(offset, self.alert)
+        if command is not None:
+            self.serial.send(*command)
+
+    def close(self):
+        with self.lock:
+            if self.cap is not None:
+                self.cap.release()
+            if self.serial is not None:
+                self.serial.close()
+            if self.store is not None and self.profile is not None and self.session_stats.count:
+                self.store.save(self.name, self.profile.merged(self.session_stats))
+            if self.recorder is not None:
+                self.recorder.close()
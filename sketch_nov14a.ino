@@ -3,8 +3,15 @@
 // Servo setup
 Servo servoX;
 Servo servoY;
-bool dataChanged = false; // Cờ để theo dõi thay đổi
-String data1;
+
+// Binary protocol (serial_link.py), 5-byte frames: SYNC, type, a, b, type ^ a ^ b
+const byte SYNC = 0xA5;
+const byte COMMAND = 0x10; // Python -> Arduino: type | alert, a = góc X, b = góc Y
+const byte ANGLES = 0x20;  // Arduino -> Python: a = góc X hiện tại, b = góc Y hiện tại
+const byte BUTTONS = 0x30; // Arduino -> Python: a = nút 1, b = nút 2
+const byte READY = 0x40;   // Arduino -> Python: khởi động xong, a = góc X, b = góc Y
+byte rxFrame[5];
+byte rxCount = 0;
 
 int servoPinX = 9; // Pin for X servo
 int servoPinY = 10; // Pin for Y servo
@@ -17,6 +24,11 @@ const int buttonPin3 = 5;     // Chân kết nối nút tắt đèn còi thủ c
 unsigned long lastPressTime1 = 0;  // Thời gian nhấn nút 1 lần cuối
 unsigned long lastPressTime2 = 0;  // Thời gian nhấn nút 2 lần cuối
 const unsigned long debounceDelay = 700;  // Thời gian debounce (200 ms)
+const unsigned long stepInterval = 20;    // ms giữa hai bước 1 độ của servo (50 độ/giây)
+const unsigned long muteDuration = 5000;  // ms tắt đèn còi sau khi nhấn nút 3
+unsigned long lastStepTime = 0;
+unsigned long mutedUntil = 0;
+bool alertOn = false;
 
 volatile bool button1Pressed = false; // Cờ để nhận biết nút 1 đã nhấn
 volatile bool button2Pressed = false; // Cờ để nhận biết nút 2 đã nhấn
@@ -44,30 +56,79 @@ void setup() {
   servoY.write(currentAngleY);
 
   Serial.begin(19200); // Match baud rate with Python
+  sendFrame(READY, currentAngleX, currentAngleY); // Python đồng bộ góc hiện tại và gửi lại lệnh
+}
+
+void sendFrame(byte type, byte a, byte b) {
+  byte frame[5] = {SYNC, type, a, b, (byte)(type ^ a ^ b)};
+  Serial.write(frame, 5);
+}
+
+void handleCommand(byte type, byte a, byte b) {
+  if ((type & 0xF0) != COMMAND) {
+    return;
+  }
+  targetAngleX = constrain(a, 0, 180); // Góc mục tiêu servoX
+  targetAngleY = constrain(b, 0, 180); // Góc mục tiêu servoY
+  alertOn = (type & 0x01) != 0;
+  sendFrame(ANGLES, currentAngleX, currentAngleY); // Servo
+}
+
+// Đọc các byte đã nhận, không chặn vòng lặp
+void readSerial() {
+  while (Serial.available() > 0) {
+    byte value = Serial.read();
+    if (rxCount == 0 && value != SYNC) {
+      continue; // Chờ byte đồng bộ
+    }
+    rxFrame[rxCount++] = value;
+    if (rxCount < 5) {
+      continue;
+    }
+    if ((rxFrame[1] ^ rxFrame[2] ^ rxFrame[3]) == rxFrame[4]) {
+      handleCommand(rxFrame[1], rxFrame[2], rxFrame[3]);
+      rxCount = 0;
+    } else {
+      // Sai checksum: bắt đầu lại từ byte SYNC tiếp theo trong khung
+      byte start = 1;
+      while (start < 5 && rxFrame[start] != SYNC) {
+        start++;
+      }
+      rxCount = 5 - start;
+      for (byte i = 0; i < rxCount; i++) {
+        rxFrame[i] = rxFrame[start + i];
+      }
+    }
+  }
 }
 
 void loop() {
 
   // Kiểm tra tín hiệu từ Python qua Serial
-  if (Serial.available() > 0) {
-    data1 = String(currentAngleX) + "," + String(currentAngleY); // Servo
-    Serial.println(data1);
+  readSerial();
 
-    String data = Serial.readStringUntil('\n'); 
-    int commaIndex1 = data.indexOf(','); 
-    int commaIndex2 = data.indexOf(',', commaIndex1 + 1);
-
-    int num1 = data.substring(0, commaIndex1).toInt(); // Số đầu tiên
-    targetAngleX = data.substring(commaIndex1 + 1, commaIndex2).toInt(); // Góc mục tiêu servoX
-    targetAngleY = data.substring(commaIndex2 + 1).toInt(); // Góc mục tiêu servoY
+  // Gửi sự kiện nút nhấn (cờ được đặt trong ngắt)
+  if (button1Pressed) {
+    button1Pressed = false;
+    sendFrame(BUTTONS, 1, 0);
+  }
+  if (button2Pressed) {
+    button2Pressed = false;
+    sendFrame(BUTTONS, 0, 1);
+  }
 
-    if (num1 == 1) {
-      digitalWrite(outputPin, HIGH);   // Đặt chân outputPin là HIGH khi nhận giá trị '1'
-    } else {
-      digitalWrite(outputPin, LOW);    // Đặt lại LOW nếu giá trị khác '1'
-    }
+  // Kiểm tra nút tắt đèn còi
+  unsigned long now = millis();
+  if (digitalRead(buttonPin3) == LOW) {
+    mutedUntil = now + muteDuration;
+  }
+  bool muted = (long)(mutedUntil - now) > 0;
+  digitalWrite(outputPin, alertOn && !muted ? HIGH : LOW);
 
+  if (now - lastStepTime < stepInterval) {
+    return; // Servo chỉ di chuyển 1 độ mỗi stepInterval, Serial vẫn được đọc liên tục
   }
+  lastStepTime = now;
 
   // Điều chỉnh góc của servoX
   if (currentAngleX < targetAngleX) {
@@ -86,14 +147,6 @@ void loop() {
   // Gửi lệnh đến servo
   servoX.write(currentAngleX);
   servoY.write(currentAngleY);
-
-  // Kiểm tra nút tắt đèn còi
-  if (digitalRead(buttonPin3) == LOW) {
-    digitalWrite(outputPin, LOW);
-    delay(5000);
-  }
-
-  delay(20); // Thêm độ trễ để làm mượt chuyển động
 }
 
 // Xử lý ngắt ngoài khi nhấn nút 1
@@ -101,7 +154,7 @@ void loop() {
 void handleButton1Press() {
   unsigned long currentMillis = millis();
   if (currentMillis - lastPressTime1 > debounceDelay) {
-    Serial.println("10");  // Gửi tín hiệu '10' ngay khi nút 1 được nhấn
+    button1Pressed = true;  // Gửi tín hiệu nút 1 trong loop()
     lastPressTime1 = currentMillis;  // Cập nhật thời gian nhấn nút 1
   }
 }
@@ -110,7 +163,7 @@ void handleButton1Press() {
 void handleButton2Press() {
   unsigned long currentMillis = millis();
   if (currentMillis - lastPressTime2 > debounceDelay) {
-    Serial.println("01");  // Gửi tín hiệu '01' ngay khi nút 2 được nhấn
+    button2Pressed = true;  // Gửi tín hiệu nút 2 trong loop()
     lastPressTime2 = currentMillis;  // Cập nhật thời gian nhấn nút 2
   }
 }
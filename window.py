@@ -0,0 +1,90 @@
+import numpy as np
+
+WINDOW_LENGTH = 20   # frames of features kept for one classification
+SUB_WINDOW_SIZE = 5  # frames per LSTM sub-window
+SUB_WINDOW_STRIDE = 3
+RUN_EVERY = 15       # frames between two classifications
+
+def n_sub_windows(length=WINDOW_LENGTH, size=SUB_WINDOW_SIZE, stride=SUB_WINDOW_STRIDE):
+    return (length - size) // stride + 1
+
+def sub_windows(input_data, size=SUB_WINDOW_SIZE, stride=SUB_WINDOW_STRIDE):
+    ''' Zero-copy view of the overlapping sub-windows the LSTM expects
+    :param input_data: Feature window of shape (20, 4) or a batch of windows (B, 20, 4)
+    :return: View of shape (6, 5, 4) or (B, 6, 5, 4)
+    '''
+    input_data = np.asarray(input_data, dtype=np.float32)
+    axis = input_data.ndim - 2
+    windows = np.lib.stride_tricks.sliding_window_view(input_data, size, axis=axis)
+    windows = windows[..., ::stride, :, :] if axis == 1 else windows[::stride]
+    return np.swapaxes(windows, -1, -2)
+
+
+class FeatureWindow:
+    ''' Fixed-size circular window of per-frame feature vectors.
+    Every sample is written twice (at i and i + length) so the last `length` samples are always
+    contiguous in memory: push is O(1) and the sub-windows are a strided view without any copy.
+    '''
+    def __init__(self, length=WINDOW_LENGTH, n_features=4, size=SUB_WINDOW_SIZE, stride=SUB_WINDOW_STRIDE,
+                 run_every=RUN_EVERY, dtype=np.float32):
+        '''
+        :param length: Number of frames kept
+        :param size: Frames per sub-window
+        :param stride: Offset between two consecutive sub-windows
+        :param run_every: Number of pushes between two classifications (frame_before_run)
+        '''
+        self.length = length
+        self.size = size
+        self.stride = stride
+        self.run_every = run_every
+        self.n_sub_windows = n_sub_windows(length, size, stride)
+        self._buffer = np.zeros((2 * length, n_features), dtype=dtype)
+        self._head = 0
+        self.count = 0
+        self.frame_before_run = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.length
+
+    def push(self, features):
+        ''' Append the features of one frame, dropping the oldest frame when full.
+        :param features: Sequence of n_features values
+        :return: True when a classification is due (run_every frames since the last one and the window is full)
+        '''
+        self._buffer[self._head] = features
+        self._buffer[self._head + self.length] = features
+        self._head = (self._head + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+        self.frame_before_run += 1
+        if self.frame_before_run >= self.run_every and self.full:
+            self.frame_before_run = 0
+            return True
+        return False
+
+    def clear(self):
+        self._head = 0
+        self.count = 0
+        self.frame_before_run = 0
+
+    def view(self):
+        ''' Read-only view of the last `count` frames, oldest first '''
+        window = self._buffer[self._head + self.length - self.count:self._head + self.length]
+        window.flags.writeable = False
+        return window
+
+    def sub_windows(self):
+        ''' Read-only strided view of shape (n_sub_windows, size, n_features).
+        Only valid once the window is full (push returned True): the strides assume `length` rows
+        '''
+        if not self.full:
+            raise ValueError('sub_windows needs a full window, %d of %d frames pushed' % (self.count, self.length))
+        window = self.view()
+        row, col = window.strides
+        return np.lib.stride_tricks.as_strided(
+            window, shape=(self.n_sub_windows, self.size, window.shape[1]),
+            strides=(self.stride * row, row, col), writeable=False)